@@ -1,46 +1,405 @@
 import numpy as np
-import random
 import copy
+import os
 import typing
+import tempfile
+import functools
+import concurrent.futures
+import logging
+import time
+import tracemalloc
 
 from perlin2d import generate_fractal_noise_2d
 from settings import *
 from color import *
-from utility import euclidian_dist
+from utility import channels, is_structured, HSV_DTYPE, Regions, downsample
+from roads import GridIndex, Router, CostGrid
+from sprites import BUSH_SPRITE, TREE_SPRITE, HOUSE_SPRITE, BOAT_SPRITE, FLAG_SPRITE
+
+# Progress of the generation is logged here (on level INFO), the generation itself does not print
+logger = logging.getLogger("PCG")
+
+# Biomes ordered by height, together with the (inclusive) upper height of every biome
+BIOME_COLORS = np.array([WATER, BEACH, GRASS, FOREST, DIRT, MOUNTAIN, SNOW])
+BIOME_THRESHOLDS = np.array([WATER_THRESHOLD, BEACH_THRESHOLD, GRASS_THRESHOLD, FOREST_THRESHOLD,
+                             DIRT_THRESHOLD, MOUNTAIN_THRESHOLD, SNOW_THRESHOLD])
+
+# Offsets of the Value-component (names of the settings) which are applied to the biomes after the generation
+VALUE_OFFSETS = [(BEACH, "BEACH_VALUE_OFFSET"), (DIRT, "DIRT_VALUE_OFFSET"), (MOUNTAIN, "MOUNTAIN_VALUE_OFFSET")]
+
+# Features which draw their random numbers from their own stream (see Map.rng), the relief has its own seed
+STREAMS = ("vegetation", "villages", "boats", "volcano", "flags", "roads", "relief")
+
+# Objects are placed at most this far from the tile of their origin (see Map.tiles), so tiles are at least this large
+MAX_REACH = max(max(SIZE_VILLAGE_X, SIZE_VILLAGE_Y) + HOUSE_SPRITE.reach,
+                BUSH_SPRITE.reach, TREE_SPRITE.reach, BOAT_SPRITE.reach, FLAG_SPRITE.reach)
+
+# Sprites of the objects which are selected per tile, in the order they are placed
+OBJECT_SPRITES = [("bushes", BUSH_SPRITE), ("trees", TREE_SPRITE), ("houses", HOUSE_SPRITE), ("boats", BOAT_SPRITE)]
+
+# Stages of the generation in order, with their message (see Map.generate)
+# Every stage only depends on the result of the earlier stages and on its settings (see SETTING_STAGES)
+STAGES = {"relief": "Generating relief ...", "biomes": "Generating biomes ...", "populate": "Populating the map ...",
+          "roads": "Adding roads to map ...", "recolor": "Recoloring the biomes ..."}
+
+# Random streams which are used by every stage, they restart whenever the stage is run again
+STAGE_STREAMS = {"populate": ("vegetation", "villages", "boats", "volcano", "flags"), "roads": ("roads",)}
+
+# Settings which can be changed per map (see Map.regenerate), with the stage which depends on them
+SETTING_STAGES = {"RES": "relief", "OCTAVE": "relief",
+                  "P_VEGETATION": "populate", "P_VEGETATION_DIRT": "populate", "P_HOUSE": "populate",
+                  "P_VILLAGE": "populate", "P_FLAG": "populate", "P_VOLCANO": "populate", "P_VOLCANO_STOP": "populate",
+                  "P_BOAT": "populate", "MAX_SIZE_VOLCANO": "populate",
+                  "P_ROAD": "roads", "MAX_DIST": "roads", "ROAD_COST": "roads", "BRIDGE_COST": "roads",
+                  "ROAD_BUDGET": "roads", "ROAD_MARGIN": "roads", "ROAD_REUSE": "roads",
+                  "BEACH_VALUE_OFFSET": "recolor", "DIRT_VALUE_OFFSET": "recolor", "MOUNTAIN_VALUE_OFFSET": "recolor"}
+
+# Return the default value of every setting which can be changed per map, as name -> value
+def default_settings() -> typing.Dict[str, typing.Any]:
+  return {name: globals()[name] for name in SETTING_STAGES}
+
+# Stages of which the result is kept as a layer (see Map.regenerate)
+LAYER_STAGES = ("biomes", "populate", "roads")
+
+# Arrays of the map which are shared with the worker processes, as memory-mapped files (see Map.__allocate)
+SHARED_ARRAYS = ("map", "relief", "snow")
+
+# The pyramid of a map (see Map.pyramid) ends with the first level of which both sides are at most PYRAMID_SIZE pixels
+# Every level is computed from the previous one in bands of PYRAMID_ROWS rows (of the previous level)
+PYRAMID_SIZE = 256
+PYRAMID_ROWS = 512
+
+# Steps (dx, dy) of the volcano stream: the eight neighbours clockwise from the top-left, and staying in place
+# The steps are drawn in blocks of STREAM_BLOCK steps, which double up to STREAM_BLOCK_MAX (see Map.__volcano_stream)
+STREAM_STEPS = np.array([[-1, -1], [0, -1], [1, -1], [1, 0], [1, 1], [0, 1], [-1, 1], [-1, 0], [0, 0]])
+STREAM_BLOCK = 1024
+STREAM_BLOCK_MAX = 2**20
+
+# Map of the worker process, set once when the worker starts (see Map.__map_tiles)
+_worker_map = None
+
+def _init_worker(map: "Map") -> None:
+  global _worker_map
+  _worker_map = map
+
+# Run a stage (a private method of Map) in a worker process, private methods can not be pickled themselves
+def _run_stage(stage: str, *args: typing.Any) -> typing.Any:
+  return getattr(_worker_map, "_Map__" + stage)(*args)
+
+
+#======== PROCEDURES ON WINDOWS ========
+# The procedures which only depend on a window of the map (e.g. a tile), shared by Map and world.World
+# A window is given by its components (hue, saturation, value, snow) and origin, the position (x,y) of its top-left pixel
+# settings are the values of SETTING_STAGES, stream returns the random stream of a feature (see STREAMS) for the window;
+# it is called more than once per feature, so it has to return the same Generator every time
+
+# Give every pixel the Hue and Saturation of the biome of its height (the Value), return which pixels are snow
+def paint_biomes(hue: np.ndarray, saturation: np.ndarray, value: np.ndarray) -> np.ndarray:
+  # Index of the biome of every pixel: BIOME_THRESHOLDS[i-1] < height <= BIOME_THRESHOLDS[i]
+  biome = np.searchsorted(BIOME_THRESHOLDS, value, side="left")
+  valid = biome < N_BIOMES  # Heights above SNOW_THRESHOLD do not belong to a biome
+  hue[valid] = BIOME_COLORS[biome[valid], 0]
+  saturation[valid] = BIOME_COLORS[biome[valid], 1]
+  return biome == N_BIOMES-1  # SNOW biome
+
+# Change the Value of the biomes of VALUE_OFFSETS by their offset, NOTE: the lightness still indicates the height of it
+# The Value is clipped to the range of the dtype, such that unsigned components do not wrap around
+def recolor_biomes(hue: np.ndarray, value: np.ndarray, settings: dict) -> None:
+  limits = np.iinfo(value.dtype)
+  for biome, offset in VALUE_OFFSETS:
+    offset = settings[offset]
+    mask = hue == biome[0]
+    value[mask] = np.clip(value[mask].astype(np.int64) + offset, limits.min, limits.max)
+
+# Select the pixels (x and y) of the window where an object is generated with rng, in order of the rows
+# For every (biome, probability), each pixel of biome is selected with probability; with snow only pixels of snow
+def select_candidates(rng: np.random.Generator, hue: np.ndarray, origin: typing.Tuple[int, int],
+                      *biomes: typing.Tuple[list, float], snow: np.ndarray = None) -> typing.Tuple[np.ndarray, np.ndarray]:
+  selected = []
+  for biome, probability in biomes:
+    pixels = np.flatnonzero((hue == biome[0]) & snow if snow is not None else hue == biome[0])
+    # Draw the number of successes, then which pixels succeeded: only O(successes) random numbers
+    n = rng.binomial(len(pixels), probability)
+    selected.append(pixels[rng.choice(len(pixels), n, replace=False)])
+  y, x = np.unravel_index(np.sort(np.concatenate(selected)), hue.shape)
+  return x + origin[0], y + origin[1]
+
+# Select the objects with their origin in the window, as name -> (x, y, colors) (see OBJECT_SPRITES)
+def select_objects(hue: np.ndarray, origin: typing.Tuple[int, int], stream: typing.Callable[[str], np.random.Generator],
+                   settings: dict) -> dict:
+  # Select the origins of the objects; Edges are cant be detected since they're smoothed
+  vegetation_x, vegetation_y = select_candidates(stream("vegetation"), hue, origin, (FOREST, settings["P_VEGETATION"]),
+                                                 (DIRT, settings["P_VEGETATION_DIRT"]))
+  villages_x, villages_y = select_candidates(stream("villages"), hue, origin, (GRASS, settings["P_VILLAGE"]))
+  boats_x, boats_y = select_candidates(stream("boats"), hue, origin, (WATER, settings["P_BOAT"]))
+
+  # Draw the random properties of every object at once
+  trunks = stream("vegetation").integers(0, 2, len(vegetation_x)) == 0
+  houses = stream("villages").random((len(villages_x), 2*SIZE_VILLAGE_Y, 2*SIZE_VILLAGE_X)) < settings["P_HOUSE"]
+  boat_hues = stream("boats").integers(0, 101, len(boats_x))
+
+  # Villages: the origin is always a house
+  village, j, i = np.nonzero(houses)
+  houses_x = np.concatenate((villages_x - SIZE_HOUSE, villages_x[village] + i - SIZE_VILLAGE_X))
+  houses_y = np.concatenate((villages_y - SIZE_HOUSE, villages_y[village] + j - SIZE_VILLAGE_Y))
+  return {"bushes": (vegetation_x[~trunks], vegetation_y[~trunks], None),  # Vegetation, trunks tells which are trees
+          "trees": (vegetation_x[trunks], vegetation_y[trunks], None),
+          "houses": (houses_x, houses_y, None),
+          "boats": (boats_x, boats_y, [[hue, 100, WATER_THRESHOLD] for hue in boat_hues]),  # Random color
+          "villages": [[x, y] for x, y in zip(villages_x.tolist(), villages_y.tolist())]}
+
+# Select the flags with their origin in the window, as the objects of select_objects
+def select_flags(hue: np.ndarray, snow: np.ndarray, origin: typing.Tuple[int, int],
+                 stream: typing.Callable[[str], np.random.Generator], settings: dict) -> dict:
+  return {"flags": select_candidates(stream("flags"), hue, origin, (SNOW, settings["P_FLAG"]), snow=snow) + (None,)}
+
+# Return the objects of name (as (x, y, colors), see select_objects) of all windows, concatenated in order
+def merge_objects(objects: list, name: str) -> typing.Tuple[np.ndarray, np.ndarray, typing.Optional[np.ndarray]]:
+  x = np.concatenate([window_objects[name][0] for window_objects in objects])
+  y = np.concatenate([window_objects[name][1] for window_objects in objects])
+  colors = None
+  if objects[0][name][2] is not None:
+    colors = np.concatenate([np.reshape(window_objects[name][2], (-1, 3)) for window_objects in objects])
+  return x, y, colors
+
+# Stamp the objects of the neighbours (as name -> (x, y, colors)) in the window (channels of a map of the given shape,
+# at offset (x,y)), the sprites (name, sprite) are stamped in order
+def stamp_objects(window: tuple, offset: typing.Tuple[int, int], shape: typing.Tuple[int, int], neighbours: list,
+                  sprites: list) -> None:
+  for name, sprite in sprites:
+    sprite.stamp(window, *merge_objects(neighbours, name), offset=offset, shape=shape)
+
 
 # Definition of the map; contains all procedures, ordered by when they are called
 class Map:
   # Initialization of the map
-  def __init__(self, res_X: int, res_Y: int, seed: int = None) -> None:
+  # dtype is the dtype of the HSV-map: either one integer dtype for all components, or HSV_DTYPE (4 bytes per pixel)
+  # relief_dtype is the dtype of the height map, e.g. np.float32 to halve its size
+  # tile_size enables the tiled generation: the map is generated in tiles of tile_size x tile_size pixels
+  # directory stores the map, relief and snow as memory-mapped .npy files in that directory instead of in memory
+  # workers is the number of processes which generate the tiles in parallel, the map does not depend on it
+  # incremental keeps the result of the stages in LAYER_STAGES, such that regenerate can restart from them
+  def __init__(self, res_X: int, res_Y: int, seed: int = None,
+               dtype: np.dtype = int, relief_dtype: np.dtype = np.float64,
+               tile_size: int = None, directory: str = None, workers: int = 1, incremental: bool = False) -> None:
+    if tile_size is not None and tile_size < MAX_REACH:
+      raise ValueError("tile_size must be at least %d" % MAX_REACH)
+    if workers < 1:
+      raise ValueError("workers must be at least 1")
     self.res_X = res_X  # Resolution of map
     self.res_Y = res_Y
-    self.map = np.empty((res_Y, res_X, 3), dtype=int) # Contains the HSV-values
-    self.relief = []    # Height map [0-100]
+    self.tile_size = tile_size
+    self.workers = workers
+    self.pool = None  # Pool of the worker processes during the generation
+    self.temporary = None
+    if directory is None and workers > 1:  # The workers share the arrays through files
+      self.temporary = tempfile.TemporaryDirectory()
+      directory = self.temporary.name
+    self.directory = directory
+    self.map = self.__allocate("map", (res_Y, res_X) if is_structured(dtype) else (res_Y, res_X, 3), dtype) # Contains the HSV-values
+    self.hue, self.saturation, self.value = channels(self.map)  # Views on the components of the map
+    self.relief = self.__allocate("relief", (res_Y, res_X), relief_dtype)  # Height map [0-100]
 
     self.origin_villages = []  # Store the origin of all villages
+    self.objects = None        # Objects of the map as name -> (x, y, colors), see OBJECT_SPRITES (and "flags")
+    self.routes = None         # Routes of the roads, every route is an array of pixels (x,y)
+    self.counters = {}         # Counters of the generation, e.g. the number of roads
+    self.report = {}           # Report of the last generation, see generate
 
     self.volcano = False  # Does the map contain a volcano?
-    self.snow = np.zeros((res_Y, res_X), dtype=bool)  # Contains location of the snow
+    self.snow = self.__allocate("snow", (res_Y, res_X), bool)  # Contains location of the snow
+    self.snow[...] = False
+
+    self.settings = default_settings()  # Settings of this map, see regenerate
+    self.incremental = incremental
+    self.layers = {}  # Stage -> result of the stage (map, snow and objects), see LAYER_STAGES
+    self.levels = []  # Levels of the pyramid of the map, see pyramid
    
     self.seed = seed
-    random.seed(self.seed)
+    # Every feature has its own random stream, such that the features do not depend on each other
+    self.entropy = np.random.SeedSequence(seed).entropy
+    self.relief_seed = self.__seed("relief")  # Seed of the noise, every tile of the relief uses the same seed
+    self.rng = {feature: np.random.default_rng(self.__seed(feature)) for feature in STREAMS if feature != "relief"}
+
+  # Return the tiles of the map as (tile_x, tile_y, rows, columns), in order of the rows
+  # Without tile_size, the whole map is one tile
+  def tiles(self) -> typing.List[typing.Tuple[int, int, slice, slice]]:
+    size_X, size_Y = (self.res_X, self.res_Y) if self.tile_size is None else (self.tile_size, self.tile_size)
+    return [(x // size_X, y // size_Y, slice(y, min(y+size_Y, self.res_Y)), slice(x, min(x+size_X, self.res_X)))
+            for y in range(0, self.res_Y, size_Y) for x in range(0, self.res_X, size_X)]
+
+  # Set the components of pixel (x,y) to color; if color has two components, only Hue and Saturation are set
+  def set_pixel(self, x: int, y: int, color: list) -> None:
+    for channel, component in zip((self.hue, self.saturation, self.value), color):
+      channel[y, x] = component
 
   # Return whether the given coordinates are on the map
   def on_map(self, x: int, y: int) -> bool:
     return 0 <= x < self.res_X and 0 <= y < self.res_Y
   
   # Start generating the map via the defined procedures
-  def generate(self) -> None:
-    print("Generating relief ...")
-    self.__relief()
-    print("Generating biomes ...")
-    self.__biomes()    # Water, beach, biomes
-    print("Populating the map ...")
-    self.__populate()  # Vegetation, villages, roads and more
-    self.__recolor()   # Give some of the biomes their correct color
-    print("Generation is complete!")
+  # Only the given stages are run (in order of STAGES), the map has to contain the result of the earlier stages
+  # after is called with the name of every stage once that stage is complete (e.g. to store the intermediate map)
+  # Return the report of the generation (also kept as self.report, which after can read as well):
+  #   {"stages": {stage: {"seconds": ..., "peak_memory": ...}}, "seconds": ..., "counters": {...}}
+  # The counters are a copy of self.counters after the last stage, later generations do not change the report
+  # The peak memory (in bytes, of this process) is only traced with memory=True, it slows the generation down
+  def generate(self, stages: typing.Iterable[str] = STAGES, after: typing.Callable[[str], None] = None,
+               memory: bool = False) -> dict:
+    self.report = {"stages": {}, "seconds": 0.0, "counters": dict(self.counters)}
+    tracing = memory and not tracemalloc.is_tracing()
+    if tracing:
+      tracemalloc.start()
+    if self.workers > 1:
+      self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self,))
+    try:
+      for stage in [stage for stage in STAGES if stage in stages]:
+        logger.info(STAGES[stage])
+        if memory:
+          tracemalloc.reset_peak()
+          start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        self.__restart_streams(stage)
+        if stage == "relief":
+          self.__relief()
+        elif stage == "biomes":
+          self.__biomes()    # Water, beach, biomes
+        elif stage == "populate":
+          self.__populate()  # Vegetation, villages and more
+        elif stage == "roads":
+          self.__roads()
+        elif stage == "recolor":
+          self.__recolor()   # Give some of the biomes their correct color
+        if self.incremental and stage in LAYER_STAGES:
+          self.__store_layer(stage)
+
+        stage_report = {"seconds": time.perf_counter() - start}
+        if memory:  # Relative to the memory at the start of the stage
+          stage_report["peak_memory"] = tracemalloc.get_traced_memory()[1] - start_memory
+        self.report["stages"][stage] = stage_report
+        self.report["seconds"] += stage_report["seconds"]
+        self.report["counters"] = dict(self.counters)
+        logger.debug("%s %.3fs", stage, stage_report["seconds"])
+        if after is not None:
+          after(stage)
+    finally:
+      if self.pool is not None:
+        self.pool.shutdown()
+        self.pool = None
+      if tracing:
+        tracemalloc.stop()
+    logger.info("Generation is complete!")
+    return self.report
   
+  # Generate the map and yield its final rows in blocks of (at most) rows rows, without keeping the final map
+  # Every block is (rows, map of the rows) with the same pixels as the map of generate. The relief, biomes and volcano
+  # are generated for the whole map and the objects and roads are planned first, then every block is completed on its
+  # own; the arrays of the map only contain the biomes (with the volcano) afterwards. The arrays stay on disk, without
+  # directory in a temporary directory (as with workers), such that only the current block is kept in memory
+  # The first block is only yielded after the relief of the whole map, which needs the extremes of all of its noise
+  # and takes most of the generation; so the blocks bound the memory, they hardly overlap with the generation
+  def stream(self, rows: int = 256) -> typing.Iterator[typing.Tuple[slice, np.ndarray]]:
+    if self.directory is None:
+      self.temporary = tempfile.TemporaryDirectory()
+      self.directory = self.temporary.name
+      for name in SHARED_ARRAYS:
+        array = getattr(self, name)
+        setattr(self, name, self.__allocate(name, array.shape, array.dtype))
+      self.hue, self.saturation, self.value = channels(self.map)
+    self.generate(["relief", "biomes"])
+    logger.info(STAGES["populate"])
+    self.__restart_streams("populate")
+    self.__restart_streams("roads")
+    objects, flags = self.__select_populate()
+    origins = [(tile[2], tile_objects, tile_flags) for tile, tile_objects, tile_flags in zip(self.tiles(), objects, flags)]
+    logger.info(STAGES["roads"])
+    x, y, water = self.__road_pixels(self.__plan_roads())
+
+    for start in range(0, self.res_Y, rows):
+      block = slice(start, min(start+rows, self.res_Y))
+      window = self.map[block].copy()
+      # Objects of the tiles which can reach the block, in order of the tiles
+      near = [(tile_objects, tile_flags) for tile_rows, tile_objects, tile_flags in origins
+              if tile_rows.start < block.stop + MAX_REACH and block.start < tile_rows.stop + MAX_REACH]
+      self.__stamp(channels(window), (0, block.start), [objects for objects, _ in near], OBJECT_SPRITES)
+      self.__stamp(channels(window), (0, block.start), [flags for _, flags in near], [("flags", FLAG_SPRITE)])
+      inside = (block.start <= y) & (y < block.stop)
+      self.__draw_pixels(channels(window), x[inside], y[inside] - block.start, water[inside])
+      self.__recolor_window(*channels(window))
+      yield block, window
+
+  # Change the given settings (see SETTING_STAGES) and generate the map again, from the first stage which depends on
+  # a changed setting; the earlier stages are not run again. Return the stages which are run
+  # The stages after the biomes restart from the layer of the stage before them (incremental), or from the biomes
+  def regenerate(self, **settings: typing.Any) -> typing.List[str]:
+    unknown = set(settings) - set(SETTING_STAGES)
+    if unknown:
+      raise ValueError("settings can not be changed per map: %s" % ", ".join(sorted(unknown)))
+    changed = {name for name, value in settings.items() if value != self.settings[name]}
+    self.settings.update(settings)
+    if not changed:
+      return []
+
+    stages = list(STAGES)
+    start = min(stages.index(SETTING_STAGES[name]) for name in changed)
+    if start > stages.index("biomes") and stages[start-1] not in self.layers:
+      start = stages.index("biomes")
+    if start == stages.index("biomes"):  # The Value-component of the relief
+      self.__map_tiles("relief_value")
+    elif start > stages.index("biomes"):
+      self.__load_layer(stages[start-1])
+    self.generate(stages[start:])
+    return stages[start:]
+
   # Return the generated map
+  # Return a preview of the map at 1/2^level of the resolution (rounded up) as {"map": ..., "relief": ...}, without
+  # generating the map: the noise is only generated at the pixels of the preview (so the relief is that of the map,
+  # sampled), without the octaves of which the cells are smaller than 2 pixels of the preview
+  # The preview only contains the biomes, and the relief is normalized with its own extremes
+  def preview(self, level: int) -> dict:
+    factor = 2**level
+    res, octaves = self.settings["RES"], 1
+    while octaves < self.settings["OCTAVE"] and min(self.res_Y / res[0], self.res_X / res[1]) / 2**octaves >= 2*factor:
+      octaves += 1
+    noise = generate_fractal_noise_2d((self.res_Y, self.res_X), res, octaves, seed=self.relief_seed,
+                                      window=(slice(0, self.res_Y, factor), slice(0, self.res_X, factor)),
+                                      dtype=self.relief.dtype)
+    relief = (noise - noise.min()) / (noise.max()-noise.min()) * 100
+    map = np.zeros(relief.shape if is_structured(self.map.dtype) else relief.shape + (3,), dtype=self.map.dtype)
+    hue, saturation, value = channels(map)
+    value[...] = relief
+    paint_biomes(hue, saturation, value)
+    recolor_biomes(hue, value, self.settings)
+    return {"map": map, "relief": relief}
+
+  # Build the pyramid of the generated map, return its levels (also kept as self.levels)
+  # Level k has 1/2^k of the resolution (rounded up), until both sides are at most PYRAMID_SIZE; level 0 is the map
+  # Every level is {"map": ..., "relief": ..., "density": ...}: the relief is the mean of the relief of the level
+  # below, the biomes are painted (and recolored) on that relief, and density is the fraction of the pixels which are
+  # covered by objects (vegetation, villages, boats, flags, the volcano and the roads)
+  # With directory, the levels are stored next to the map as memory-mapped files (pyramid<k>_map.npy, ...)
+  def pyramid(self) -> typing.List[dict]:
+    self.levels = [{"map": self.map, "relief": self.relief, "density": None}]
+    shape = (self.res_Y, self.res_X)
+    while max(shape) > PYRAMID_SIZE:
+      shape = (-(-shape[0] // 2), -(-shape[1] // 2))
+      below, name = self.levels[-1], "pyramid%d_" % len(self.levels)
+      level = {"map": self.__allocate(name + "map", shape + self.map.shape[2:], self.map.dtype),
+               "relief": self.__allocate(name + "relief", shape, self.relief.dtype),
+               "density": self.__allocate(name + "density", shape, np.float32)}
+      for start in range(0, shape[0], PYRAMID_ROWS // 2):
+        rows = slice(start, min(start + PYRAMID_ROWS//2, shape[0]))
+        source = slice(2*rows.start, 2*rows.stop)
+        relief = downsample(below["relief"][source])
+        level["relief"][rows] = relief
+        level["density"][rows] = downsample(self.__covered(source) if below["density"] is None else below["density"][source])
+        hue, saturation, value = channels(level["map"][rows])
+        value[...] = relief
+        paint_biomes(hue, saturation, value)
+        recolor_biomes(hue, value, self.settings)
+      self.levels.append(level)
+    return self.levels
+
   def get_map(self) -> np.ndarray:
     return self.map
   
@@ -49,249 +408,308 @@ class Map:
     return self.relief
 
 
+  # The worker processes receive the memory-mapped arrays by their file, such that they write in the same arrays
+  def __getstate__(self) -> dict:
+    state = self.__dict__.copy()
+    del state["hue"], state["saturation"], state["value"], state["pool"], state["temporary"]
+    del state["layers"], state["levels"]
+    if self.directory is not None:
+      for name in SHARED_ARRAYS:
+        state[name] = state[name].filename
+    return state
+
+  def __setstate__(self, state: dict) -> None:
+    if state["directory"] is not None:
+      for name in SHARED_ARRAYS:
+        state[name] = np.load(state[name], mmap_mode="r+")
+    self.__dict__.update(state, pool=None, temporary=None, layers={}, levels=[])
+    self.hue, self.saturation, self.value = channels(self.map)
+
   # Private methods of class
 
+  # Apply the stage (name of a private method) to every tile, with the i-th item of the iterables as arguments
+  # The tiles are divided over the worker processes, the results are returned in order of the tiles
+  def __map_tiles(self, stage: str, *iterables: typing.Iterable) -> list:
+    if self.pool is None:
+      return list(map(getattr(self, "_Map__" + stage), self.tiles(), *iterables))
+    return list(self.pool.map(functools.partial(_run_stage, stage), self.tiles(), *iterables))
+
+  # Allocate an array of the map, memory-mapped in self.directory if it is given
+  def __allocate(self, name: str, shape: tuple, dtype: np.dtype) -> np.ndarray:
+    if self.directory is None:
+      return np.zeros(shape, dtype=dtype)
+    return np.lib.format.open_memmap(os.path.join(self.directory, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+
+  # Restart the random streams of the stage (see STAGE_STREAMS), such that running a stage again gives the same result
+  def __restart_streams(self, stage: str) -> None:
+    for feature in STAGE_STREAMS.get(stage, ()):
+      self.rng[feature] = np.random.default_rng(self.__seed(feature))
+
+  # Seed of the random stream of feature (see STREAMS)
+  def __seed(self, feature: str) -> np.random.SeedSequence:
+    return np.random.SeedSequence(self.entropy, spawn_key=(STREAMS.index(feature),))
+
+  # Keep the result of the stage as layer
+  def __store_layer(self, stage: str) -> None:
+    layer = self.layers.setdefault(stage, {"map": self.__allocate(stage + "_map", self.map.shape, self.map.dtype),
+                                           "snow": self.__allocate(stage + "_snow", self.snow.shape, bool)})
+    layer["map"][...] = self.map
+    layer["snow"][...] = self.snow
+    layer.update(origin_villages=list(self.origin_villages), volcano=self.volcano, counters=dict(self.counters),
+                 objects=self.objects, routes=self.routes)
+
+  # Restore the map to the result of the stage
+  def __load_layer(self, stage: str) -> None:
+    layer = self.layers[stage]
+    self.map[...] = layer["map"]
+    self.snow[...] = layer["snow"]
+    self.origin_villages, self.volcano = list(layer["origin_villages"]), layer["volcano"]
+    self.objects, self.routes = layer["objects"], layer["routes"]
+    self.counters = dict(layer["counters"])
+
+  # Random stream of feature for the objects of the given tile; the whole map uses the streams of self.rng
+  def __stream(self, feature: str, tile: tuple) -> np.random.Generator:
+    if self.tile_size is None:
+      return self.rng[feature]
+    return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=(STREAMS.index(feature), tile[0], tile[1])))
+
+  # Return the stream function of the tile (see PROCEDURES ON WINDOWS): one Generator per feature, which continues
+  # where it stopped when it is requested again
+  def __tile_streams(self, tile: tuple) -> typing.Callable[[str], np.random.Generator]:
+    return functools.lru_cache(maxsize=None)(functools.partial(self.__stream, tile=tile))
+
+  # Return which pixels of the rows are covered by objects: the pixels of which the color is not that of the biome of
+  # their height (see pyramid)
+  def __covered(self, rows: slice) -> np.ndarray:
+    hue, saturation, value = channels(self.map[rows])
+    biome_hue, biome_saturation = np.zeros_like(hue), np.zeros_like(saturation)
+    biome_value = self.relief[rows].astype(value.dtype)  # The Value of the biomes, as in __height
+    paint_biomes(biome_hue, biome_saturation, biome_value)
+    recolor_biomes(biome_hue, biome_value, self.settings)
+    return (hue != biome_hue) | (saturation != biome_saturation) | (value != biome_value)
+
   #======== RELIEF GENERATION PROCEDURES ========
   # Here, the Value-component is used to represent the height of one pixel
-  # Perlin noise is used to generate the relief
+  # Perlin noise is used to generate the relief, tile by tile; the noise of the tiles matches seamlessly
   def __relief(self) -> None:
-    # Generate Perlin Noise
-    noise = generate_fractal_noise_2d((self.res_Y, self.res_X), RES, OCTAVE, seed=self.seed)
+    extremes = np.array(self.__map_tiles("noise"))
+    low, high = extremes[:, 0].min(), extremes[:, 1].max()
+    n = len(self.tiles())
+    self.__map_tiles("height", [low]*n, [high]*n)
+
+  # Generate the Perlin Noise of the tile, return its extremes
+  def __noise(self, tile: tuple) -> typing.Tuple[float, float]:
+    _, _, rows, cols = tile
+    noise = generate_fractal_noise_2d((self.res_Y, self.res_X), self.settings["RES"], self.settings["OCTAVE"],
+                                      seed=self.relief_seed, window=(rows, cols), dtype=self.relief.dtype)
+    self.relief[rows, cols] = noise
+    return noise.min(), noise.max()
 
+  # Normalize the noise of the tile with the extremes of the whole map
+  def __height(self, tile: tuple, low: float, high: float) -> None:
+    _, _, rows, cols = tile
     # Normalize to [0, 1], then multiply with 100 for Value (of HSV)
-    self.relief = (noise - noise.min()) / (noise.max()-noise.min()) * 100
+    relief = (self.relief[rows, cols] - low) / (high-low) * 100
+    self.relief[rows, cols] = relief
+
+    # Copy the noise to the map, Value-component gets the height-value
+    self.value[rows, cols] = relief
+
+  # Copy the relief of the tile to the Value-component again, e.g. when the biomes are generated again
+  def __relief_value(self, tile: tuple) -> None:
+    _, _, rows, cols = tile
+    self.value[rows, cols] = self.relief[rows, cols]
 
-    # Copy the noise to the map
-    for y in range(self.res_Y):
-      for x in range(self.res_X):
-        self.map[y][x][2] = self.relief[y][x]  # Value-component gets the height-value
-    
 
   #======== BIOME GENERATION PROCEDURES ========
   # Here, the Hue- and Saturation-components are altered to represent biomes
   def __biomes(self) -> None:
-    # Loop over all pixels in the map
-    for y in range(self.res_Y):
-      for x in range(self.res_X):
-        height = self.map[y][x][2]
-        # WATER biome
-        if height <= WATER_THRESHOLD:
-          self.map[y][x][:2] = WATER
-        # BEACH biome
-        elif height <= BEACH_THRESHOLD:
-          self.map[y][x][:2] = BEACH
-        # GRASS biome
-        elif height <= GRASS_THRESHOLD:
-          self.map[y][x][:2] = GRASS
-        # FOREST biome
-        elif height <= FOREST_THRESHOLD:
-          self.map[y][x][:2] = FOREST
-        # DIRT biome
-        elif height <= DIRT_THRESHOLD:
-          self.map[y][x][:2] = DIRT
-        # MOUNTAIN biome
-        elif height <= MOUNTAIN_THRESHOLD:
-          self.map[y][x][:2] = MOUNTAIN
-        # SNOW biome
-        elif height <= SNOW_THRESHOLD:
-          self.map[y][x][:2] = SNOW
-          self.snow[y][x] = True
+    self.__map_tiles("tile_biomes")
+
+  def __tile_biomes(self, tile: tuple) -> None:
+    _, _, rows, cols = tile
+    self.snow[rows, cols] = paint_biomes(self.hue[rows, cols], self.saturation[rows, cols], self.value[rows, cols])
   
   # Due to the use of HSV in combination with relief, it was not possible to give each..
   # .. biome their correct color with __biomes(), so here the Value is changed for the correct color
   # But since all other transformations are finished, we can alter the Value of each pixel in the biomes
   # Moreover, the actual height is saved in self.relief, so no information is lost
   def __recolor(self) -> None:
-    # Loop over all pixels in the map
-    for y in range(self.res_Y):
-      for x in range(self.res_X):
-        # Change the color, NOTE: the lightness still indicates the height of it
-        if self.map[y][x][0] == BEACH[0]:
-          self.map[y][x][2] += BEACH_VALUE_OFFSET
-        elif self.map[y][x][0] == DIRT[0]:
-          self.map[y][x][2] += DIRT_VALUE_OFFSET
-        elif self.map[y][x][0] == MOUNTAIN[0]:
-          self.map[y][x][2] += MOUNTAIN_VALUE_OFFSET
+    self.__map_tiles("tile_recolor")
+
+  def __tile_recolor(self, tile: tuple) -> None:
+    _, _, rows, cols = tile
+    self.__recolor_window(self.hue[rows, cols], self.saturation[rows, cols], self.value[rows, cols])
+
+  # Recolor the pixels with the given components
+  def __recolor_window(self, hue: np.ndarray, saturation: np.ndarray, value: np.ndarray) -> None:
+    recolor_biomes(hue, value, self.settings)
 
 
   #======== POPULATE GENERATION PROCEDURES ========
   # Add various objects to the generated world (villages, roads, vegetation, etc.)
+  # First the candidates of every feature are selected on the biomes, then the objects are placed
+  # Both happen per tile; objects of neighbouring tiles which overlap a tile are placed in that tile as well
+  # The volcano spans multiple tiles, it is part of the terrain and placed on the whole map first
   def __populate(self) -> None:
-    # Loop over all pixels in the map
-    for y in range(self.res_Y):
-      for x in range(self.res_X):
-        hue = self.map[y][x][0] # Get unique Hue -> identify biomes
-                                # Edges are cant be detected since they're smoothed
-        P = random.uniform(0,1)
-        if hue == FOREST[0] and P < P_VEGETATION: # Generate vegetation
-          self.__vegetation(x, y)
-        
-        elif hue == DIRT[0] and P < P_VEGETATION_DIRT:  # Generate vegetation
-          self.__vegetation(x, y)
-
-        elif hue == GRASS[0] and P < P_VILLAGE:   # Generate village
-          self.origin_villages.append([x,y])
-          self.__village(x, y)
-        
-        elif hue == WATER[0] and P < P_BOAT:      # Generate a boat
-          self.__boat(x, y)
-
-        elif hue == SNOW[0]:
-          if not self.volcano and P < P_VOLCANO:
-            self.__volcano(x, y)        # Replace top of mountain with volcano
-            self.__volcano_stream(x, y)
-            self.volcano = True
-          elif P < P_FLAG:
-            self.__flag_mountain(x, y)  # Generate flag of climbers
-    print("Adding roads to map ...")
-    self.__roads()
-  
-  # Generate a boat
-  def __boat(self, x: int, y: int) -> None:
-    # Check if boat fits on map
-    if not (self.on_map(x+LEN_SIDES, y-2*LEN_SIDES) and self.on_map(x-LEN_BOAT-LEN_SIDES, y)):
-      return
-
-    # Create the boat - bottom half
-    for j in range(-LEN_SIDES, 1):
-      for i in range(-LEN_BOAT+j, -j):
-        self.map[y+j][x+i] = BOAT_BROWN
-    # Create the boat - top half
-    random_hue = random.randint(0, 100)  # Random color 
-    for j in range(-LEN_SIDES+1, 1):
-      for i in range(-LEN_SIDES-3, 1):
-        self.map[y-LEN_SIDES-1+j][x+i] = [random_hue, 100, WATER_THRESHOLD] # Random color
-    
-  # Extend the volcano stream with one pixel, return the next end of the stream
-  def __extend_stream(self, x: int, y: int, direction: int) -> typing.Tuple[int, int]:
-    if direction == 0:    # Top-left
-      x -= 1
-      y -= 1
-    elif direction == 1:  # Top
-      y -= 1
-    elif direction == 2:  # Top-right
-      x += 1
-      y -= 1
-    elif direction == 3:  # Right
-      x += 1
-    elif direction == 4:  # Bottom-right
-      x += 1
-      y += 1
-    elif direction == 5:  # Bottom
-      y += 1
-    elif direction == 6:  # Bottom-left
-      y += 1
-      x -= 1
-    elif direction == 7:  # Left
-      x -= 1
-    if not self.on_map(x, y) or self.map[y][x][0] == FOREST[0]:
-      return -1, -1  # End of the map is reached, stop
-
-    for j in range(-1, 2):
-      for i in range(-1, 2):
-        if self.on_map(x+i, y+j):
-          self.map[y][x][:2] = VOLCANO_COLOR[random.randint(0,2)]
-    return x, y
-
-  # Add a stream going down the volcano
+    objects, flags = self.__select_populate()
+    n = len(objects)
+    self.__map_tiles("place_objects", self.__neighbours(objects), [OBJECT_SPRITES]*n)
+    self.__map_tiles("place_objects", self.__neighbours(flags), [[("flags", FLAG_SPRITE)]]*n)  # Generate flags of climbers
+
+  # Place the volcano and select the objects and flags of every tile (see __select_objects), without placing them
+  # The selection only depends on the biomes and the volcano, so the objects can be placed in any order (see stream)
+  def __select_populate(self) -> typing.Tuple[list, list]:
+    self.origin_villages, self.volcano = [], False
+    self.__place_volcano()
+    objects = self.__map_tiles("select_objects")
+    for tile_objects in objects:
+      self.origin_villages.extend(tile_objects["villages"])
+    # Flags are placed on the remaining snow (self.snow is updated by __volcano)
+    flags = self.__map_tiles("select_flags")
+
+    self.objects = {name: merge_objects(objects, name) for name, _ in OBJECT_SPRITES}
+    self.objects["flags"] = merge_objects(flags, "flags")
+    for name, (x, _, _) in self.objects.items():
+      self.counters[name] = len(x)
+    self.counters["villages"] = len(self.origin_villages)
+    return objects, flags
+
+  # Select the flags with their origin in the tile, see select_flags
+  def __select_flags(self, tile: tuple) -> dict:
+    _, _, rows, cols = tile
+    return select_flags(self.hue[rows, cols], self.snow[rows, cols], (cols.start, rows.start),
+                        self.__tile_streams(tile), self.settings)
+
+  # Return the objects of the neighbours of every tile (including the tile itself), objects is in order of the tiles
+  # The neighbours are taken in order of the rows, so overlapping objects are placed in the same order in every tile
+  def __neighbours(self, objects: list) -> list:
+    objects = {tile[:2]: tile_objects for tile, tile_objects in zip(self.tiles(), objects)}
+    return [[objects[(tile_x+i, tile_y+j)] for j in range(-1, 2) for i in range(-1, 2) if (tile_x+i, tile_y+j) in objects]
+            for tile_x, tile_y, _, _ in self.tiles()]
+
+  # Select the objects with their origin in the tile, see select_objects
+  def __select_objects(self, tile: tuple) -> dict:
+    _, _, rows, cols = tile
+    return select_objects(self.hue[rows, cols], (cols.start, rows.start), self.__tile_streams(tile), self.settings)
+
+  # Place the objects of the neighbours of the tile (as name -> (x, y, colors), see __neighbours) in the tile
+  def __place_objects(self, tile: tuple, neighbours: list, sprites: list) -> None:
+    _, _, rows, cols = tile
+    self.__stamp(channels(self.map[rows, cols]), (cols.start, rows.start), neighbours, sprites)
+
+  # Stamp the objects of the neighbours in the window (channels of the map at offset (x,y)), see __place_objects
+  def __stamp(self, window: tuple, offset: typing.Tuple[int, int], neighbours: list, sprites: list) -> None:
+    stamp_objects(window, offset, (self.res_Y, self.res_X), neighbours, sprites)
+
+  # The first snow-pixel (in order of the rows) which succeeds with P_VOLCANO becomes the volcano
+  # Only pixels of snow-regions with at most MAX_SIZE_VOLCANO pixels are considered
+  def __place_volcano(self) -> None:
+    self.counters["volcano_pixels"] = self.counters["volcano_stream_pixels"] = 0
+    regions = self.snow_regions()
+    runs = np.flatnonzero(regions.sizes[regions.labels] <= self.settings["MAX_SIZE_VOLCANO"])
+    lengths = np.cumsum(regions.ends[runs] - regions.starts[runs])
+    first = self.rng["volcano"].geometric(self.settings["P_VOLCANO"]) - 1
+    if len(runs) > 0 and first < lengths[-1]:
+      run = np.searchsorted(lengths, first, side="right")
+      x = regions.ends[runs[run]] - (lengths[run] - first)
+      y = regions.rows[runs[run]]
+      self.__volcano(regions, regions.labels[runs[run]])  # Replace top of mountain with volcano
+      self.counters["volcano_pixels"] = int(regions.sizes[regions.labels[runs[run]]])
+      self.__volcano_stream(x, y)
+      self.volcano = True
+
+  # Add a stream going down the volcano: a random walk from (x,y) over the eight neighbours (or staying in place),
+  # which ends where it leaves the map or reaches a forest; every pixel of the walk gets a color of VOLCANO_COLOR
+  # After the end the walk continues with probability P_VOLCANO_STOP from (-1,-1), as the stream always did
+  # The steps are drawn in blocks and applied with array operations, up to where the stream ends
   def __volcano_stream(self, x: int, y: int) -> None:
-    prev = 12  # Previous direction: 12-4=8 (8 is not a direction, see __extend_stream)
-    while not x == -1 or random.uniform(0,1) < P_VOLCANO_STOP: # If x == -1, end is reached
-      # Determine next direction, eight surrounding pixels
-      direction = random.randint(0, 8)
-      if abs(direction-4) == prev: # Direction is backwards, prevent this
-        direction = (direction + random.randint(0, 7)) % 8
-      x, y = self.__extend_stream(x, y, direction)
-
-  # Replace the top of the mountain with a volcano
-  # This is done recursively, where self.snow is updated
-  def __volcano(self, x: int, y: int) -> None:
-    if not self.snow[y][x]:
-      return
-    self.map[y][x][:2] = VOLCANO_COLOR[random.randint(0,2)]
-    self.snow[y][x] = False
-
-    for j in range(-1, 2):
-      for i in range(-1, 2):
-        if self.on_map(x+i, y+j):
-          if self.snow[y+j][x+i]:
-            self.__volcano(x+i, y+j)
-          elif self.map[y+j][x+i][2] <= MOUNTAIN_THRESHOLD:
-            self.map[y+j][x+i] = VOLCANO_STONE
-
-  # Generate flag on top of a mountain
-  def __flag_mountain(self, x: int, y: int) -> None:
-    # Check if flag is not outside map
-    if not (self.on_map(x, y+4) and self.on_map(x+3, y-3)):
-      return
-    # Draw the flag
-    for j in range(y-3, y+5):
-      self.map[j][x] = FLAG_BLACK
-    self.map[y-1][x+1] = FLAG_RED
-    self.map[y-1][x+2] = FLAG_RED
-    self.map[y-1][x+3] = FLAG_RED
-    self.map[y-2][x+1] = FLAG_RED
-    self.map[y-2][x+2] = FLAG_RED
-    self.map[y-2][x+3] = FLAG_RED
-
-  # Generate some vegetation (bushes/trees)
-  def __vegetation(self, x: int, y: int) -> None:
-    for j in range(-3, 0):
-      for i in range(-3, 0):
-        if self.on_map(x+i, y+j):
-          self.map[y+j][x+i] = PLANT
-    if random.randint(0,1) == 0 and self.on_map(x-2, y): # Generate a trunk
-      self.map[y][x-2] = TRUNK
-      
-  # Generate a house
-  def __house(self, x: int, y: int) -> None:
-    for j in range(-SIZE_HOUSE, 1):
-      for i in range(-SIZE_HOUSE, 1):
-        if self.on_map(x+i, y+j) and not self.map[y+j][x+i][0] == WATER[0]: # Not on water
-          self.map[y+j][x+i] = HOUSE
-
-  # Generate a village with origin (x,y)
-  def __village(self, x: int, y: int) -> None:
-    self.__house(x-SIZE_HOUSE, y-SIZE_HOUSE) # Origin is always a house
-    for j in range(-SIZE_VILLAGE_Y, SIZE_VILLAGE_Y):
-      for i in range(-SIZE_VILLAGE_X, SIZE_VILLAGE_X):
-        if random.uniform(0,1) < P_HOUSE: # Generate a house
-          self.__house(x+i, y+j)
+    rng = self.rng["volcano"]
+    colors = np.array(VOLCANO_COLOR)
+    block = STREAM_BLOCK
+    while True:
+      path = np.array([x, y]) + np.cumsum(STREAM_STEPS[rng.integers(0, len(STREAM_STEPS), block)], axis=0)
+      px, py = path[:, 0], path[:, 1]
+      valid = (0 <= px) & (px < self.res_X) & (0 <= py) & (py < self.res_Y)
+      valid[valid] = self.hue[py[valid], px[valid]] != FOREST[0]
+      n = block if valid.all() else int(np.argmin(valid))  # Pixels up to the end of the stream
+      color = colors[rng.integers(0, len(colors), n)]
+      self.hue[py[:n], px[:n]], self.saturation[py[:n], px[:n]] = color[:, 0], color[:, 1]
+      self.counters["volcano_stream_pixels"] += n
+      if n == block:  # The stream goes on, with larger blocks
+        x, y, block = int(px[-1]), int(py[-1]), min(2*block, STREAM_BLOCK_MAX)
+      elif rng.random() < self.settings["P_VOLCANO_STOP"]:
+        x, y, block = -1, -1, STREAM_BLOCK
+      else:
+        return
+
+  # Replace the top of the mountain (the snow-region with the given label) with a volcano
+  # The surrounding pixels become stone, these are found by dilating the region; self.snow is updated
+  def __volcano(self, regions: Regions, label: int) -> None:
+    x, y = regions.pixels(label)
+    colors = np.array(VOLCANO_COLOR)[self.rng["volcano"].integers(0, len(VOLCANO_COLOR), len(x))]
+    self.hue[y, x], self.saturation[y, x] = colors[:, 0], colors[:, 1]
+    self.snow[y, x] = False
+
+    # Only the bounding box of the region (with a margin of one pixel) is considered
+    x0, y0 = max(x.min()-1, 0), max(y.min()-1, 0)
+    x1, y1 = min(x.max()+2, self.res_X), min(y.max()+2, self.res_Y)
+    region = np.zeros((y1-y0, x1-x0), dtype=bool)
+    region[y-y0, x-x0] = True
+    padded = np.pad(region, 1)
+    dilated = np.zeros_like(region)
+    for j in range(3):
+      for i in range(3):
+        dilated |= padded[j:j+y1-y0, i:i+x1-x0]
+    ring = dilated & ~region & (self.value[y0:y1, x0:x1] <= MOUNTAIN_THRESHOLD)
+    ring_y, ring_x = np.nonzero(ring)
+    for channel, component in zip((self.hue, self.saturation, self.value), VOLCANO_STONE):
+      channel[ring_y+y0, ring_x+x0] = component
+
+  # Return the connected regions of snow, with their sizes (see utility.Regions)
+  def snow_regions(self) -> Regions:
+    return Regions(self.snow)
 
 
   #======== ROAD GENERATION PROCEDURES ========
-  # Randomly select which villages are connected with each other
   def __roads(self) -> None:
-    for j in range(len(self.origin_villages)):
-      for i in range(j+1, len(self.origin_villages)):
-        V1, V2 = self.origin_villages[i], self.origin_villages[j]
-        if random.uniform(0,1) < P_ROAD and euclidian_dist(V1, V2) <= MAX_DIST:
-          self.__connect(V1, V2) # Connect the villages V1 and V2 with road
-  
-  # Connect the two given villages
-  def __connect(self, start: list, end: list) -> None:
-    x, y = start[0], start[1] # Starting point
-    while not [x, y] == end:  # Destination not reached yet
-      color = BRIDGE if self.map[y][x][2] < WATER_THRESHOLD else ROAD
-      if self.on_map(x, y):
-        self.map[y][x] = color
-      
-      x, y = self.__get_next_pixel(x, y, end)
-      if x == -1:  # No pixels left, unable to create road. Road ends here
-        break
-  
-  # Get the next pixel to continue road with, this pixel has shortest distance to end
-  def __get_next_pixel(self, x: int, y: int, end: list) -> typing.Tuple[int, int]:
-    best_dist = MAX_DIST
-    next_x, next_y = -1, -1
-    for j in range(-1, 2):
-      for i in range(-1, 2):
-        if i == 0 and j == 0:  # Skip current pixel
-          continue
-        # Roads have to avoid the mountains
-        if self.on_map(x+i, y+j) and self.map[y+j][x+i][2] <= DIRT_THRESHOLD:
-          dist = euclidian_dist([x+i, y+j], end)
-          if dist < best_dist:
-            best_dist = dist
-            next_x, next_y = x+i, y+j
-    return next_x, next_y
\ No newline at end of file
+    for route in self.__plan_roads():
+      x, y, water = self.__road_pixels([route])
+      self.__draw_pixels((self.hue, self.saturation, self.value), x, y, water)
+
+  # Randomly select which villages are connected with each other, return the routes of the roads
+  # Only the pairs within MAX_DIST are enumerated (with a spatial index), each is connected with probability P_ROAD
+  # The routes only depend on the relief, so the roads can be drawn in any order (see stream)
+  def __plan_roads(self) -> typing.List[np.ndarray]:
+    settings = self.settings
+    index = GridIndex(self.origin_villages, settings["MAX_DIST"])
+    first, second = index.pairs()
+    connect = self.rng["roads"].random(len(first)) < settings["P_ROAD"]
+    cost = CostGrid(self.relief, settings["ROAD_COST"], settings["BRIDGE_COST"])
+    router = Router(cost, settings["ROAD_BUDGET"], settings["ROAD_MARGIN"], settings["ROAD_REUSE"])
+
+    routes = []
+    for j, i in zip(first[connect], second[connect]):
+      route = router.route(self.origin_villages[i], self.origin_villages[j])
+      if route is not None:  # Connect the villages with road
+        routes.append(route)
+    self.counters["road_pairs_examined"] = index.examined
+    self.counters["road_pairs_in_range"] = len(first)
+    self.counters["roads_built"] = len(routes)
+    self.counters["roads_failed"] = int(connect.sum()) - len(routes)
+    self.counters["road_pixels_expanded"] = router.expanded
+    self.counters["road_pixels_shared"] = router.shared
+    self.counters["road_pixels"] = sum(len(route) for route in routes)
+    self.routes = routes
+    return routes
+
+  # Return the pixels (x and y) of the routes, and whether they are on water (there the road becomes a bridge)
+  def __road_pixels(self, routes: typing.List[np.ndarray]) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    pixels = np.concatenate(routes) if routes else np.zeros((0, 2), dtype=np.intp)
+    x, y = pixels[:, 0], pixels[:, 1]
+    return x, y, np.floor(self.relief[y, x]) < WATER_THRESHOLD
+
+  # Draw the pixels of roads in the window (channels), see __road_pixels
+  def __draw_pixels(self, window: tuple, x: np.ndarray, y: np.ndarray, water: np.ndarray) -> None:
+    for channel, road, bridge in zip(window, ROAD, BRIDGE):
+      channel[y, x] = np.where(water, bridge, road)
@@ -0,0 +1,161 @@
+# Generation of many maps at once, e.g. for datasets: a library function and a command-line interface
+# Usage: python3 batch.py --seeds 0:10000 --resolution 1280x720 --output maps/ [--workers 8] [--compact] [--image png]
+#                         [-v | -q]
+
+import os
+import sys
+import queue
+import typing
+import logging
+import argparse
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+
+from PCG import Map, HSV_DTYPE
+import export
+
+# Progress of the batches is logged here, the maps themselves are logged by PCG (on level INFO)
+logger = logging.getLogger("batch")
+
+# Number of maps which are generated or written ahead of the consumer, per worker
+PENDING_PER_WORKER = 2
+
+
+# Generate the map of one seed, in a worker process
+def _generate(seed: int, res_X: int, res_Y: int, options: dict) -> np.ndarray:
+  M = Map(res_X, res_Y, seed, **options)
+  M.generate()
+  return M.get_map()
+
+# Generate the maps of the seeds (see Map for the options), return an iterator of (seed, map) in order of the seeds
+# The maps are generated by a pool of worker processes (by default one per core), or in this process if workers is 1
+# At most PENDING_PER_WORKER maps per worker are generated ahead of the consumer, so any number of seeds can be given
+def generate_maps(seeds: typing.Iterable[int], res_X: int, res_Y: int, workers: int = None,
+                  **options: typing.Any) -> typing.Iterator[typing.Tuple[int, np.ndarray]]:
+  workers = workers or os.cpu_count() or 1
+  if workers == 1:
+    for seed in seeds:
+      yield seed, _generate(seed, res_X, res_Y, options)
+    return
+
+  seeds = iter(seeds)
+  with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+    pending = collections.deque()
+    for seed in seeds:
+      pending.append((seed, pool.submit(_generate, seed, res_X, res_Y, options)))
+      if len(pending) >= PENDING_PER_WORKER * workers:
+        seed, future = pending.popleft()
+        yield seed, future.result()
+    while pending:
+      seed, future = pending.popleft()
+      yield seed, future.result()
+
+# Write the maps (as path, map) of the queue until None is received, images are exported by their extension
+def _writer(maps: queue.Queue, errors: list) -> None:
+  while True:
+    item = maps.get()
+    if item is None:
+      return
+    path, map = item
+    try:
+      if path.endswith(".npy"):
+        np.save(path, map)
+      else:
+        export.save_map(map, path)
+    except Exception as error:  # Raised by the generating thread, the writer keeps taking the maps off the queue
+      errors.append(error)
+
+# Generate the maps of the seeds and write them to directory as map_<seed>.npy, return the number of maps
+# With image (an extension of export.WRITERS, e.g. "png"), the maps are stored in RGB as map_<seed>.<image> instead
+# The files are written by a background thread while the next maps are generated
+# progress is called with the number of written maps and the number of seeds (if known) after every map
+def generate_to_directory(seeds: typing.Iterable[int], res_X: int, res_Y: int, directory: str, workers: int = None,
+                          progress: typing.Callable[[int, typing.Optional[int]], None] = None, image: str = None,
+                          **options: typing.Any) -> int:
+  if image is not None and "." + image not in export.WRITERS:
+    raise ValueError("unknown image format %r" % image)
+  name = "map_%d.npy" if image is None else "map_%d." + image
+  os.makedirs(directory, exist_ok=True)
+  total = len(seeds) if hasattr(seeds, "__len__") else None
+  maps = queue.Queue(maxsize=PENDING_PER_WORKER * (workers or os.cpu_count() or 1))
+  errors = []
+  writer = threading.Thread(target=_writer, args=(maps, errors), daemon=True)
+  writer.start()
+
+  count = 0
+  try:
+    for seed, map in generate_maps(seeds, res_X, res_Y, workers, **options):
+      if errors:
+        raise errors[0]
+      maps.put((os.path.join(directory, name % seed), map))
+      count += 1
+      if progress is not None:
+        progress(count, total)
+      logger.debug("Generated map %d (%d/%s)", seed, count, total if total is not None else "?")
+  finally:
+    maps.put(None)
+    writer.join()
+  if errors:
+    raise errors[0]
+  logger.info("Generated %d maps of %dx%d in %s", count, res_X, res_Y, directory)
+  return count
+
+
+#======== COMMAND-LINE INTERFACE ========
+# Parse a list of seeds: comma-separated seeds and ranges (first:last, last excluded), e.g. "1,5,10:20"
+def parse_seeds(text: str) -> typing.List[int]:
+  seeds = []
+  for part in text.split(","):
+    if ":" in part:
+      first, last = part.split(":")
+      seeds.extend(range(int(first), int(last)))
+    else:
+      seeds.append(int(part))
+  return seeds
+
+# Parse a resolution as WIDTHxHEIGHT, e.g. "1280x720"
+def parse_resolution(text: str) -> typing.Tuple[int, int]:
+  try:
+    res_X, res_Y = (int(value) for value in text.lower().split("x"))
+  except ValueError:
+    raise argparse.ArgumentTypeError("resolution must be WIDTHxHEIGHT, e.g. 1280x720")
+  if res_X <= 0 or res_Y <= 0:
+    raise argparse.ArgumentTypeError("resolution must be positive")
+  return res_X, res_Y
+
+def main(argv: typing.List[str] = None) -> int:
+  parser = argparse.ArgumentParser(description="Generate the maps of many seeds and store them in a directory.")
+  parser.add_argument("--seeds", type=parse_seeds, required=True, help="seeds and ranges, e.g. 0:10000 or 1,5,10:20")
+  parser.add_argument("--resolution", type=parse_resolution, default=(1280, 720), help="WIDTHxHEIGHT (default 1280x720)")
+  parser.add_argument("--output", required=True, help="directory of the maps")
+  parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per core)")
+  parser.add_argument("--compact", action="store_true", help="store the maps with HSV_DTYPE (4 bytes per pixel)")
+  parser.add_argument("--image", choices=[extension[1:] for extension in export.WRITERS], default=None,
+                      help="store the maps as RGB image (default: the HSV-maps as .npy)")
+  parser.add_argument("--tile-size", type=int, default=None, help="generate every map in tiles of this size")
+  verbosity = parser.add_mutually_exclusive_group()
+  verbosity.add_argument("-v", "--verbose", action="store_true", help="log every map")
+  verbosity.add_argument("-q", "--quiet", action="store_true", help="only log errors")
+  args = parser.parse_args(argv)
+
+  level = logging.DEBUG if args.verbose else logging.ERROR if args.quiet else logging.INFO
+  logging.basicConfig(level=level, format="%(message)s")
+  logging.getLogger("PCG").setLevel(logging.WARNING)  # Not the stages of every map
+
+  # Log the progress about every percent
+  step = max(len(args.seeds) // 100, 1)
+  def progress(done: int, total: int) -> None:
+    if done % step == 0 or done == total:
+      logger.info("%d/%d maps", done, total)
+
+  options = {"dtype": HSV_DTYPE, "relief_dtype": np.float32} if args.compact else {}
+  res_X, res_Y = args.resolution
+  generate_to_directory(args.seeds, res_X, res_Y, args.output, args.workers, progress, args.image,
+                        tile_size=args.tile_size, **options)
+  return 0
+
+# Start of script
+if __name__ == "__main__":
+  sys.exit(main())
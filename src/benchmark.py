@@ -0,0 +1,421 @@
+# Benchmarks of the generation procedures, compares them against their original (loop-based) versions
+# Usage: python3 benchmark.py [passes] [hsv] [storage] [populate] [road_pairs] [roads] [workers] [noise] [cache] [export]
+#                          [stages] [suite] [--resolutions 720p,1080p,4K,8K] [--json results.json]
+#                          [--baseline baseline.json] [--threshold 0.1]
+# The suite measures the time and peak memory of every stage, which can be stored as JSON and compared to a baseline
+
+import os
+import sys
+import json
+import argparse
+import platform
+import tracemalloc
+import shutil
+import tempfile
+import time
+import typing
+import numpy as np
+
+from PCG import Map, HSV_DTYPE
+from perlin2d import generate_fractal_noise_2d
+from settings import *
+from color import *
+from utility import HSV_to_RGB, HSV_LUT, euclidian_dist
+from roads import GridIndex
+from cache import MapCache
+import export
+
+# Resolutions which are benchmarked, as (res_X, res_Y)
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "4K": (3840, 2160), "8K": (7680, 4320)}
+DEFAULT_RESOLUTIONS = ("720p", "1080p", "4K")  # 8K needs about 2 GB of memory and takes long with the loop versions
+SEED = 42
+
+# Relative slowdown (or increase of the peak memory) of a measurement against the baseline which is a regression
+REGRESSION_THRESHOLD = 0.1
+
+
+#======== HELPERS ========
+# Return the time (in seconds) of the fastest of repeat calls to fn
+def best_of(fn: typing.Callable, repeat: int = 3) -> float:
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+# Return the peak memory (in bytes, traced with tracemalloc) of a call to fn, relative to the memory before the call
+def peak_memory(fn: typing.Callable) -> int:
+  tracing = tracemalloc.is_tracing()
+  if not tracing:
+    tracemalloc.start()
+  tracemalloc.reset_peak()
+  start = tracemalloc.get_traced_memory()[0]
+  try:
+    fn()
+    return tracemalloc.get_traced_memory()[1] - start
+  finally:
+    if not tracing:
+      tracemalloc.stop()
+
+# Return the time of the fastest of repeat calls to fn and the peak memory of another (traced) call
+def measure(fn: typing.Callable, repeat: int = 3) -> typing.Dict[str, float]:
+  return {"seconds": best_of(fn, repeat), "peak_memory": peak_memory(fn)}
+
+# Return a map with biomes and a function which returns the routing of the roads between n villages (placed on
+# random pixels of grass), the villages are drawn in order of the calls
+def road_setup(res_X: int, res_Y: int) -> typing.Tuple[Map, typing.Callable[[int], typing.Callable]]:
+  M = Map(res_X, res_Y, SEED)
+  M._Map__relief()
+  M._Map__biomes()
+  base = M.map.copy()
+  grass = np.flatnonzero(M.hue == GRASS[0])
+  rng = np.random.default_rng(SEED)
+  def routing(n: int) -> typing.Callable:
+    y, x = np.unravel_index(rng.choice(grass, min(n, len(grass)), replace=False), M.snow.shape)
+    def run() -> None:
+      M.map[...] = base
+      M.rng["roads"] = np.random.default_rng(SEED)
+      M.origin_villages = np.stack((x, y), axis=1).tolist()
+      M._Map__roads()
+    return run
+  return M, routing
+
+
+#======== ORIGINAL IMPLEMENTATIONS ========
+# Pixel-by-pixel versions of the passes of Map, used as reference
+def loop_relief(M: Map) -> None:
+  noise = generate_fractal_noise_2d((M.res_Y, M.res_X), RES, OCTAVE, seed=M.relief_seed)
+  M.relief = (noise - noise.min()) / (noise.max()-noise.min()) * 100
+  for y in range(M.res_Y):
+    for x in range(M.res_X):
+      M.map[y][x][2] = M.relief[y][x]
+
+def loop_biomes(M: Map) -> None:
+  thresholds = [(WATER_THRESHOLD, WATER), (BEACH_THRESHOLD, BEACH), (GRASS_THRESHOLD, GRASS),
+                (FOREST_THRESHOLD, FOREST), (DIRT_THRESHOLD, DIRT), (MOUNTAIN_THRESHOLD, MOUNTAIN),
+                (SNOW_THRESHOLD, SNOW)]
+  for y in range(M.res_Y):
+    for x in range(M.res_X):
+      height = M.map[y][x][2]
+      for threshold, biome in thresholds:
+        if height <= threshold:
+          M.map[y][x][:2] = biome
+          M.snow[y][x] = biome is SNOW
+          break
+
+def loop_recolor(M: Map) -> None:
+  for y in range(M.res_Y):
+    for x in range(M.res_X):
+      if M.map[y][x][0] == BEACH[0]:
+        M.map[y][x][2] += BEACH_VALUE_OFFSET
+      elif M.map[y][x][0] == DIRT[0]:
+        M.map[y][x][2] += DIRT_VALUE_OFFSET
+      elif M.map[y][x][0] == MOUNTAIN[0]:
+        M.map[y][x][2] += MOUNTAIN_VALUE_OFFSET
+
+def loop_convert(H: float, C: float, X: float) -> typing.Tuple[float, float, float]:
+  if 0 <= H < 60:
+    return (C, X, 0)
+  elif 60 <= H < 120:
+    return (X, C, 0)
+  elif 120 <= H < 180:
+    return (0, C, X)
+  elif 180 <= H < 240:
+    return (0, X, C)
+  elif 240 <= H < 300:
+    return (X, 0, C)
+  elif 300 <= H <= 360:
+    return (C, 0, X)
+
+def loop_HSV_to_RGB(map: np.ndarray) -> np.ndarray:
+  res_X, res_Y = len(map[0]), len(map)
+  RGB_map = np.empty((res_Y, res_X, 3))
+  div = np.array([1, 100, 100])
+  for y in range(res_Y):
+    for x in range(res_X):
+      pixel = map[y][x] / div
+      C = pixel[1] * pixel[2]
+      X = C * (1 - abs((pixel[0] / 60) % 2 - 1))
+      m = pixel[2] - C
+      RGB_map[y][x] = loop_convert(pixel[0], C, X) + m
+  return RGB_map
+
+
+#======== BENCHMARKS ========
+# Time the relief, biome and recolor passes of Map against their loop-based versions
+def bench_passes(res_X: int, res_Y: int, repeat: int = 3) -> None:
+  M = Map(res_X, res_Y, SEED)
+  M._Map__relief()
+  reference = Map(res_X, res_Y, SEED)
+  base = M.map.copy()
+
+  passes = [("relief", M._Map__relief, loop_relief),
+            ("biomes", M._Map__biomes, loop_biomes),
+            ("recolor", M._Map__recolor, loop_recolor)]
+  for name, vectorized, loop in passes:
+    # Time the vectorized pass on a fresh copy of the input of that pass
+    def run() -> None:
+      M.map[...] = base
+      vectorized()
+    t_vec = best_of(run, repeat)
+    M.map[...] = base
+    vectorized()
+
+    reference.map[...] = base
+    start = time.perf_counter()
+    loop(reference)
+    t_loop = time.perf_counter() - start
+
+    identical = np.array_equal(M.map, reference.map)
+    print("  %-8s loop: %8.3fs  vectorized: %8.4fs  speedup: %7.1fx  identical: %s"
+          % (name, t_loop, t_vec, t_loop / t_vec, identical))
+    base = M.map.copy()
+
+# Time the conversion of HSV to RGB (direct and with lookup-table) against the loop-based version
+def bench_HSV_to_RGB(res_X: int, res_Y: int, repeat: int = 3) -> None:
+  M = Map(res_X, res_Y, SEED)
+  M.generate()
+  map = M.get_map()
+
+  start = time.perf_counter()
+  reference = loop_HSV_to_RGB(map)
+  t_loop = time.perf_counter() - start
+  reference_uint8 = np.rint(np.clip(reference, 0, 1) * 255).astype(np.uint8)
+  print("  %-14s %8.3fs" % ("loop", t_loop))
+
+  HSV_LUT(np.dtype(np.uint8))  # Build the lookup-tables once, outside of the timings
+  HSV_LUT(np.dtype(np.float32))
+  variants = [("float32", np.float32, False), ("uint8", np.uint8, False),
+              ("float32 (LUT)", np.float32, True), ("uint8 (LUT)", np.uint8, True)]
+  for name, dtype, lut in variants:
+    t = best_of(lambda: HSV_to_RGB(map, dtype, lut), repeat)
+    RGB = HSV_to_RGB(map, dtype, lut)
+    if dtype == np.uint8:
+      error = np.abs(RGB.astype(int) - reference_uint8).max()
+    else:
+      error = np.abs(np.clip(RGB, 0, 1) - np.clip(reference, 0, 1)).max()
+    print("  %-14s %8.4fs  speedup: %7.1fx  max. error: %g" % (name, t, t_loop / t, error))
+
+# Compare the memory (bytes per pixel) and generation time of the default and the compact storage
+def bench_storage(res_X: int, res_Y: int, repeat: int = 1) -> None:
+  layouts = [("int", int, np.float64), ("HSV_DTYPE", HSV_DTYPE, np.float32)]
+  for name, dtype, relief_dtype in layouts:
+    M = Map(res_X, res_Y, SEED, dtype, relief_dtype)
+    t = best_of(M._Map__relief, repeat)
+    size = M.map.nbytes + M.relief.nbytes + M.snow.nbytes
+    print("  %-10s map: %4.1f B/px  total: %4.1f B/px (%7.1f MB)  relief: %.3fs"
+          % (name, M.map.nbytes / (res_X*res_Y), size / (res_X*res_Y), size / 2**20, t))
+
+# Time the population of the map (selection of the candidates, placing the objects and the roads)
+def bench_populate(res_X: int, res_Y: int, repeat: int = 3) -> None:
+  M = Map(res_X, res_Y, SEED)
+  M._Map__relief()
+  M._Map__biomes()
+  base, snow = M.map.copy(), M.snow.copy()
+  def run() -> None:
+    M.__init__(res_X, res_Y, SEED)  # Fresh random streams and object lists
+    M.map[...], M.snow = base, snow.copy()
+    M._Map__populate()
+  t = best_of(run, repeat)
+  print("  populate   %.4fs  villages: %d  volcano: %s" % (t, len(M.origin_villages), M.volcano))
+
+# Time the enumeration of the pairs of villages within MAX_DIST: all pairs versus the spatial index
+# The number of villages scales with the area of the map, with densities relative to P_VILLAGE
+def bench_road_pairs(res_X: int, res_Y: int, repeat: int = 3) -> None:
+  rng = np.random.default_rng(SEED)
+  for density in (1, 10, 100):
+    n = int(density * P_VILLAGE * res_X * res_Y / 4)  # Roughly a quarter of the map is grass
+    villages = np.stack((rng.integers(0, res_X, n), rng.integers(0, res_Y, n)), axis=1).tolist()
+    def all_pairs() -> None:
+      [(i, j) for j in range(n) for i in range(j+1, n) if euclidian_dist(villages[i], villages[j]) <= MAX_DIST]
+    t_all = best_of(all_pairs, 1) if n <= 2000 else float("nan")
+    index = GridIndex(villages, MAX_DIST)
+    t_index = best_of(lambda: GridIndex(villages, MAX_DIST).pairs(), repeat)
+    first, _ = index.pairs()
+    print("  %5dx villages: %6d  all pairs: %8.4fs  index: %8.4fs  examined: %9d / %11d  in range: %d"
+          % (density, n, t_all, t_index, index.examined, n*(n-1) // 2, len(first)))
+
+# Time the routing of the roads on a map with hundreds of villages (placed on random pixels of grass)
+def bench_roads(res_X: int, res_Y: int, repeat: int = 1) -> None:
+  M, routing = road_setup(res_X, res_Y)
+  for n in (100, 300, 1000):
+    t = best_of(routing(n), repeat)
+    c = M.counters
+    print("  villages: %5d  roads: %8.4fs  in range: %6d  built: %4d  failed: %3d  expanded: %8d (%.0f per road)"
+          "  shared: %6d" % (len(M.origin_villages), t, c["road_pairs_in_range"], c["roads_built"], c["roads_failed"],
+                             c["road_pixels_expanded"],
+                             c["road_pixels_expanded"] / max(c["roads_built"] + c["roads_failed"], 1),
+                             c["road_pixels_shared"]))
+
+# Time the tiled generation with an increasing number of worker processes, the maps have to be identical
+def bench_workers(res_X: int, res_Y: int, repeat: int = 1, tile_size: int = 512) -> None:
+  reference = None
+  workers = 1
+  while workers <= (os.cpu_count() or 1):
+    M = Map(res_X, res_Y, SEED, tile_size=tile_size, workers=workers)
+    t = best_of(M.generate, repeat)
+    if reference is None:
+      reference, t_single = M.get_map().copy(), t
+    print("  workers: %2d  generate: %8.3fs  speedup: %5.2fx  identical: %s"
+          % (workers, t, t_single / t, np.array_equal(M.get_map(), reference)))
+    workers *= 2
+
+# Time the fractal noise of the exact resolution (float64 and float32) against the noise of the resolution which
+# was required before: the smallest multiple of lacunarity^(octaves-1)*res, of which the map was cropped
+def bench_noise(res_X: int, res_Y: int, repeat: int = 3) -> None:
+  step_X, step_Y = 2**(OCTAVE-1) * RES[1], 2**(OCTAVE-1) * RES[0]
+  padded = (-(-res_Y // step_Y) * step_Y, -(-res_X // step_X) * step_X)
+  t_padded = best_of(lambda: generate_fractal_noise_2d(padded, RES, OCTAVE, seed=SEED), repeat)
+  print("  padded   %dx%d  %8.4fs" % (padded[1], padded[0], t_padded))
+  for dtype in (np.float64, np.float32):
+    t = best_of(lambda: generate_fractal_noise_2d((res_Y, res_X), RES, OCTAVE, seed=SEED, dtype=dtype), repeat)
+    print("  %-8s %dx%d  %8.4fs  speedup: %5.2fx" % (np.dtype(dtype).name, res_X, res_Y, t, t_padded / t))
+
+# Time the generation through the cache: from scratch (and stored), a hit and a restart after the biomes
+def bench_cache(res_X: int, res_Y: int, repeat: int = 1) -> None:
+  for compress in (True, False):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = MapCache(directory, compress=compress)
+      t_miss = best_of(lambda: cache.generate(res_X, res_Y, SEED), 1)
+      t_hit = best_of(lambda: cache.generate(res_X, res_Y, SEED), repeat)
+      size = sum(size for _, size in cache.entries().values())
+      # Remove the stages after the biomes, such that the map is restarted from the biomes
+      keys = cache.keys(res_X, res_Y, SEED)
+      for stage in ("populate", "roads", "recolor"):
+        shutil.rmtree(os.path.join(directory, keys[stage]))
+      t_restart = best_of(lambda: cache.generate(res_X, res_Y, SEED), 1)
+      print("  %s  miss: %8.3fs  hit: %8.4fs (%6.1fx)  restart after biomes: %8.3fs  size: %7.1f MB"
+            % ("npz" if compress else "npy", t_miss, t_hit, t_miss / t_hit, t_restart, size / 2**20))
+
+# Time the export of a map to every format of export.py, and to PNG with matplotlib (if it is installed)
+def bench_export(res_X: int, res_Y: int, repeat: int = 3) -> None:
+  M = Map(res_X, res_Y, SEED)
+  M.generate()
+  with tempfile.TemporaryDirectory() as directory:
+    for extension in export.WRITERS:
+      path = os.path.join(directory, "map" + extension)
+      t = best_of(lambda: export.save_map(M.get_map(), path), repeat)
+      print("  %-10s %8.4fs  %7.1f MB" % (extension, t, os.path.getsize(path) / 2**20))
+    try:
+      start = time.perf_counter()
+      import matplotlib.pyplot as plt
+      t_import = time.perf_counter() - start
+    except ImportError:
+      print("  matplotlib is not installed")
+      return
+    def pyplot() -> None:
+      plt.imshow(HSV_to_RGB(M.get_map(), np.uint8))
+      plt.axis("off")
+      plt.savefig(os.path.join(directory, "pyplot.png"), bbox_inches="tight")
+      plt.close()
+    print("  %-10s %8.4fs  (import: %.3fs)" % ("pyplot", best_of(pyplot, repeat), t_import))
+
+# Report of the generation: the time and peak memory of every stage, and the overhead of tracing the memory
+def bench_stages(res_X: int, res_Y: int, repeat: int = 1) -> None:
+  t = best_of(lambda: Map(res_X, res_Y, SEED).generate(), repeat)
+  report = Map(res_X, res_Y, SEED).generate(memory=True)
+  for stage, stage_report in report["stages"].items():
+    print("  %-8s %8.4fs  peak: %7.1f MB" % (stage, stage_report["seconds"], stage_report["peak_memory"] / 2**20))
+  print("  total    %8.4fs  traced: %8.4fs" % (t, report["seconds"]))
+  print("  counters:", ", ".join("%s: %d" % item for item in report["counters"].items()))
+
+# The time and peak memory of the noise, every stage of Map, the roads with an increasing number of villages and the
+# conversion of HSV to RGB, returned as name -> {"seconds": ..., "peak_memory": ...}
+def bench_suite(res_X: int, res_Y: int, repeat: int = 3) -> typing.Dict[str, typing.Dict[str, float]]:
+  results = {}
+  for dtype in (np.float64, np.float32):
+    results["noise_" + np.dtype(dtype).name] = measure(
+      lambda: generate_fractal_noise_2d((res_Y, res_X), RES, OCTAVE, seed=SEED, dtype=dtype), repeat)
+
+  # The stages are timed without tracing, of the fastest of repeat maps
+  reports = [Map(res_X, res_Y, SEED).generate() for _ in range(repeat)]
+  traced = Map(res_X, res_Y, SEED)
+  traced.generate(memory=True)
+  for stage, stage_report in traced.report["stages"].items():
+    results["stage_" + stage] = {"seconds": min(report["stages"][stage]["seconds"] for report in reports),
+                                 "peak_memory": stage_report["peak_memory"]}
+  map = traced.get_map()
+
+  _, routing = road_setup(res_X, res_Y)
+  for n in (100, 300, 1000):
+    results["roads_%d" % n] = measure(routing(n), 1)
+
+  HSV_LUT(np.dtype(np.uint8))  # Build the lookup-table once, outside of the measurements
+  for name, dtype, lut in (("float32", np.float32, False), ("uint8", np.uint8, False), ("uint8_lut", np.uint8, True)):
+    results["hsv_" + name] = measure(lambda: HSV_to_RGB(map, dtype, lut), repeat)
+
+  for name, result in results.items():
+    print("  %-16s %8.4fs  peak: %8.1f MB" % (name, result["seconds"], result["peak_memory"] / 2**20))
+  return results
+
+BENCHMARKS = {"passes": bench_passes, "hsv": bench_HSV_to_RGB, "storage": bench_storage, "populate": bench_populate,
+              "road_pairs": bench_road_pairs, "roads": bench_roads, "workers": bench_workers,
+              "noise": bench_noise, "cache": bench_cache,
+              "export": bench_export, "stages": bench_stages, "suite": bench_suite}
+
+
+#======== RESULTS ========
+# Return the measurements of the results which are more than threshold slower or larger than those of the baseline,
+# as (resolution, benchmark, measurement, quantity, baseline, result); only measurements in both are compared
+def regressions(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> typing.List[tuple]:
+  found = []
+  for resolution, benchmarks in results["results"].items():
+    for benchmark, measurements in benchmarks.items():
+      reference = baseline["results"].get(resolution, {}).get(benchmark, {})
+      for name, measurement in measurements.items():
+        for quantity, value in measurement.items():
+          old = reference.get(name, {}).get(quantity)
+          if old is not None and value > old * (1 + threshold):
+            found.append((resolution, benchmark, name, quantity, old, value))
+  return found
+
+def main(argv: typing.List[str] = None) -> int:
+  parser = argparse.ArgumentParser(description="Benchmark the generation of maps.")
+  parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                      help="benchmarks to run: %s (default: all, or suite with --json or --baseline)"
+                           % ", ".join(BENCHMARKS))
+  parser.add_argument("--resolutions", type=lambda text: text.split(","), default=list(DEFAULT_RESOLUTIONS),
+                      help="comma-separated resolutions of %s (default: %s)"
+                           % (", ".join(RESOLUTIONS), ",".join(DEFAULT_RESOLUTIONS)))
+  parser.add_argument("--json", help="store the results of the suite in this file")
+  parser.add_argument("--baseline", help="compare the results of the suite to the results in this file")
+  parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                      help="relative increase which is a regression (default: %g)" % REGRESSION_THRESHOLD)
+  args = parser.parse_args(argv)
+  for name in args.benchmarks:
+    if name not in BENCHMARKS:
+      parser.error("unknown benchmark %r, use one of %s" % (name, ", ".join(BENCHMARKS)))
+  for name in args.resolutions:
+    if name not in RESOLUTIONS:
+      parser.error("unknown resolution %r, use one of %s" % (name, ", ".join(RESOLUTIONS)))
+  names = args.benchmarks or (["suite"] if args.json or args.baseline else list(BENCHMARKS))
+
+  results = {"seed": SEED, "python": platform.python_version(), "numpy": np.__version__,
+             "machine": platform.machine(), "results": {}}
+  for name in args.resolutions:
+    res_X, res_Y = RESOLUTIONS[name]
+    print("%s (%dx%d)" % (name, res_X, res_Y))
+    for benchmark in names:
+      print(" ", benchmark)
+      measurements = BENCHMARKS[benchmark](res_X, res_Y)
+      if measurements is not None:
+        results["results"].setdefault(name, {})[benchmark] = measurements
+
+  if args.json:
+    with open(args.json, "w") as file:
+      json.dump(results, file, indent=2)
+  if args.baseline:
+    with open(args.baseline) as file:
+      baseline = json.load(file)
+    found = regressions(results, baseline, args.threshold)
+    print("%d regressions against %s (threshold: %g)" % (len(found), args.baseline, args.threshold))
+    for resolution, benchmark, name, quantity, old, value in found:
+      print("  %-6s %-6s %-16s %-12s %12.4g -> %12.4g (%+.0f%%)"
+            % (resolution, benchmark, name, quantity, old, value, (value / old - 1) * 100))
+    return 1 if found else 0
+  return 0
+
+# Start of script
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,180 @@
+# Contains the on-disk cache of generated maps, keyed on the resolution, seed and settings
+# Every stage of the generation (see PCG.STAGES) is stored, so a map can be restarted from a cached intermediate map
+
+import os
+import json
+import shutil
+import typing
+import hashlib
+import tempfile
+import numpy as np
+
+import settings
+import color
+from PCG import Map, STAGES, SETTING_STAGES, SHARED_ARRAYS, default_settings
+from utility import channels
+
+# Version of the layout of the entries, entries of another version are never hit
+CACHE_VERSION = 2
+
+# Return the first stage which depends on a setting (or color), see PCG.SETTING_STAGES
+# The settings which can not be changed per map are used throughout the generation, so all stages depend on them
+def setting_stage(name: str) -> str:
+  return SETTING_STAGES.get(name, "relief")
+
+
+# Return the values on which the generation depends, as name -> value: the settings of the map (see Map.settings)
+# and the public definitions of settings.py and color.py which can not be changed per map
+def definitions(map_settings: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+  values = {}
+  for module in (settings, color):
+    values.update((name, value) for name, value in vars(module).items()
+                  if name.isupper() and name not in SETTING_STAGES)
+  values.update(map_settings)
+  return values
+
+# Cache of generated maps in directory, with at most budget bytes on disk
+# Entries are stored as .npy files which are memory-mapped when loaded, or with compress=True as compressed .npz
+# (about 4 times smaller, but slower to store and load); the objects and routes of the map are stored next to them
+# When the budget is exceeded, the least recently used entries are removed
+class MapCache:
+  def __init__(self, directory: str, budget: int = 2**30, compress: bool = False) -> None:
+    self.directory = directory
+    self.budget = budget
+    self.compress = compress
+    os.makedirs(directory, exist_ok=True)
+
+    self.hits = {stage: 0 for stage in STAGES}  # Number of maps which are restarted after every stage
+    self.misses = 0                             # Number of maps which are generated from scratch
+
+  # Return the key of every stage of the map with the given arguments (see Map) and settings (see Map.regenerate),
+  # as stage -> key. The key of a stage covers the arguments of Map which affect it and the settings of that and all
+  # earlier stages
+  def keys(self, res_X: int, res_Y: int, seed: int, settings: typing.Dict[str, typing.Any] = None,
+           **options: typing.Any) -> typing.Dict[str, str]:
+    if seed is None:
+      raise ValueError("only maps with a seed can be cached")
+    map_settings = default_settings()
+    unknown = set(settings or {}) - set(map_settings)
+    if unknown:
+      raise ValueError("settings can not be changed per map: %s" % ", ".join(sorted(unknown)))
+    map_settings.update(settings or {})
+    values = definitions(map_settings)
+    arguments = {"version": CACHE_VERSION, "resolution": (res_X, res_Y), "seed": seed,
+                 "dtype": str(np.dtype(options.get("dtype", int))),
+                 "relief_dtype": str(np.dtype(options.get("relief_dtype", np.float64)))}
+    digest = hashlib.sha256(repr(sorted(arguments.items())).encode())
+    keys = {}
+    for stage in STAGES:
+      if stage == "populate":  # The objects are selected per tile
+        digest.update(repr(options.get("tile_size")).encode())
+      names = sorted(name for name in values if setting_stage(name) == stage)
+      digest.update(repr([(name, values[name]) for name in names]).encode())
+      keys[stage] = digest.copy().hexdigest()
+    return keys
+
+  # Return the map with the given arguments (see Map) and settings (see Map.regenerate), generated or restarted from
+  # the latest cached stage. Every stage which is generated is stored in the cache
+  def generate(self, res_X: int, res_Y: int, seed: int, settings: typing.Dict[str, typing.Any] = None,
+               **options: typing.Any) -> Map:
+    keys = self.keys(res_X, res_Y, seed, settings, **options)
+    M = Map(res_X, res_Y, seed, **options)
+    M.settings.update(settings or {})
+    stages = list(STAGES)
+    for i in reversed(range(len(stages))):
+      if self.load(keys[stages[i]], M):
+        self.hits[stages[i]] += 1
+        stages = stages[i+1:]
+        break
+    else:
+      self.misses += 1
+    if stages:
+      M.generate(stages, after=lambda stage: self.store(keys[stage], M))
+    return M
+
+  # Load the entry into the map, return whether the entry exists
+  def load(self, key: str, M: Map) -> bool:
+    path = os.path.join(self.directory, key)
+    if not os.path.isdir(path):
+      return False
+    os.utime(path)  # Most recently used
+    if self.compress:
+      with np.load(os.path.join(path, "layers.npz")) as layers:
+        arrays = {name: layers[name] for name in SHARED_ARRAYS}
+    else:  # Copy-on-write, such that the later stages do not alter the entry
+      arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="c") for name in SHARED_ARRAYS}
+    for name, array in arrays.items():
+      if M.directory is None:
+        setattr(M, name, array)
+      else:  # Keep the memory-mapped files of the map
+        getattr(M, name)[...] = array
+    M.hue, M.saturation, M.value = channels(M.map)
+
+    with open(os.path.join(path, "meta.json")) as file:
+      meta = json.load(file)
+    M.origin_villages, M.volcano, M.counters = meta["origin_villages"], meta["volcano"], meta["counters"]
+    with np.load(os.path.join(path, "objects.npz")) as objects:
+      M.objects = None
+      if meta["objects"] is not None:
+        M.objects = {name: (objects[name + "_x"], objects[name + "_y"],
+                            objects[name + "_colors"] if name + "_colors" in objects else None)
+                     for name in meta["objects"]}
+      M.routes = None
+      if meta["routes"]:
+        pixels, lengths = objects["routes"], objects["route_lengths"]
+        M.routes = [pixels[end-n:end] for n, end in zip(lengths, np.cumsum(lengths))]
+    return True
+
+  # Store the map as entry key, then evict the least recently used entries until the cache fits the budget
+  def store(self, key: str, M: Map) -> None:
+    path = os.path.join(self.directory, key)
+    if os.path.isdir(path):
+      return
+    # Write the entry next to the cache and move it in place at once, such that no partial entry can be loaded
+    temporary = tempfile.mkdtemp(dir=self.directory, prefix=".")
+    if self.compress:
+      np.savez_compressed(os.path.join(temporary, "layers.npz"), **{name: getattr(M, name) for name in SHARED_ARRAYS})
+    else:
+      for name in SHARED_ARRAYS:
+        np.save(os.path.join(temporary, name + ".npy"), getattr(M, name))
+    objects = {}
+    for name, (x, y, colors) in (M.objects or {}).items():
+      objects[name + "_x"], objects[name + "_y"] = x, y
+      if colors is not None:
+        objects[name + "_colors"] = np.reshape(colors, (-1, 3))
+    if M.routes is not None:
+      objects["routes"] = np.concatenate(M.routes) if M.routes else np.zeros((0, 2), dtype=np.intp)
+      objects["route_lengths"] = np.array([len(route) for route in M.routes], dtype=np.intp)
+    (np.savez_compressed if self.compress else np.savez)(os.path.join(temporary, "objects.npz"), **objects)
+    meta = {"origin_villages": [[int(x), int(y)] for x, y in M.origin_villages], "volcano": bool(M.volcano),
+            "counters": M.counters, "objects": None if M.objects is None else list(M.objects),
+            "routes": M.routes is not None}
+    with open(os.path.join(temporary, "meta.json"), "w") as file:
+      json.dump(meta, file)
+    try:
+      os.rename(temporary, path)
+    except OSError:  # Stored by another process in the meantime
+      shutil.rmtree(temporary)
+    self.evict(keep=key)
+
+  # Return the size (in bytes) of every entry, as key -> (last use, size)
+  def entries(self) -> typing.Dict[str, typing.Tuple[float, int]]:
+    entries = {}
+    for key in os.listdir(self.directory):
+      path = os.path.join(self.directory, key)
+      if key.startswith(".") or not os.path.isdir(path):
+        continue
+      size = sum(entry.stat().st_size for entry in os.scandir(path))
+      entries[key] = (os.stat(path).st_mtime, size)
+    return entries
+
+  # Remove the least recently used entries (except keep) until the total size is at most the budget
+  def evict(self, keep: str = None) -> None:
+    entries = self.entries()
+    total = sum(size for _, size in entries.values())
+    for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+      if total <= self.budget:
+        break
+      if key != keep:
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+        total -= size
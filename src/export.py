@@ -0,0 +1,72 @@
+# Contains the export of maps to images (PNG and PPM) and arrays (NPY), pixel-exact and without matplotlib
+# The maps are converted and written in blocks of rows, such that maps larger than the memory can be exported
+
+import os
+import zlib
+import struct
+import typing
+import numpy as np
+
+from utility import HSV_to_RGB
+
+# Number of rows which are converted and written at once
+BLOCK_ROWS = 256
+
+
+# Return the RGB-blocks (uint8, rows x width x 3) of the HSV-map, of at most rows rows each
+def rgb_blocks(map: np.ndarray, rows: int = BLOCK_ROWS, lut: bool = False) -> typing.Iterator[np.ndarray]:
+  for y in range(0, len(map), rows):
+    yield HSV_to_RGB(map[y:y+rows], np.uint8, lut)
+
+#======== WRITERS ========
+# Every writer writes the RGB-blocks (uint8, of the given width and in total height rows) to the binary file
+
+# Write a chunk of a PNG-file: length, type, data and CRC
+def _png_chunk(file: typing.BinaryIO, kind: bytes, data: bytes) -> None:
+  file.write(struct.pack(">I", len(data)))
+  file.write(kind)
+  file.write(data)
+  file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+# PNG: 8-bit RGB, every row without filter; level is the compression level of zlib
+def write_png(file: typing.BinaryIO, blocks: typing.Iterable[np.ndarray], width: int, height: int,
+              level: int = 6) -> None:
+  file.write(b"\x89PNG\r\n\x1a\n")
+  _png_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+  compressor = zlib.compressobj(level)
+  for block in blocks:
+    # Every row starts with its filter type (0: none)
+    rows = np.zeros((len(block), 1 + 3*width), dtype=np.uint8)
+    rows[:, 1:] = block.reshape(len(block), 3*width)
+    data = compressor.compress(rows.tobytes())
+    if data:
+      _png_chunk(file, b"IDAT", data)
+  _png_chunk(file, b"IDAT", compressor.flush())
+  _png_chunk(file, b"IEND", b"")
+
+# PPM: binary (P6) with 8-bit components
+def write_ppm(file: typing.BinaryIO, blocks: typing.Iterable[np.ndarray], width: int, height: int) -> None:
+  file.write(b"P6\n%d %d\n255\n" % (width, height))
+  for block in blocks:
+    file.write(np.ascontiguousarray(block, dtype=np.uint8).tobytes())
+
+# NPY: an uint8 array of height x width x 3, as numpy.save
+def write_npy(file: typing.BinaryIO, blocks: typing.Iterable[np.ndarray], width: int, height: int) -> None:
+  np.lib.format.write_array_header_1_0(file, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+                                              "fortran_order": False, "shape": (height, width, 3)})
+  for block in blocks:
+    file.write(np.ascontiguousarray(block, dtype=np.uint8).tobytes())
+
+# Writer of every extension
+WRITERS = {".png": write_png, ".ppm": write_ppm, ".npy": write_npy}
+
+
+# Save the HSV-map as image (or RGB-array), the format follows from the extension of path (see WRITERS)
+# Every pixel of the map is one pixel of the image; the map is converted and written per block of rows rows
+def save_map(map: np.ndarray, path: str, rows: int = BLOCK_ROWS, lut: bool = False) -> None:
+  extension = os.path.splitext(path)[1].lower()
+  if extension not in WRITERS:
+    raise ValueError("unknown format %r, use one of %s" % (extension, ", ".join(WRITERS)))
+  height, width = map.shape[:2]
+  with open(path, "wb") as file:
+    WRITERS[extension](file, rgb_blocks(map, rows, lut), width, height)
@@ -1,23 +1,29 @@
-import matplotlib.pyplot as plt
+import os
 import numpy as np
+import logging
 
 from PCG import Map
 from utility import HSV_to_RGB
+import export
+import mapfile
 
-# Save generated map with pyplot
+# Save generated map; PNG, PPM and NPY are written pixel-exact by export.py, other formats with pyplot
 def save_map(map: np.ndarray, output: str) -> None:
   print("\nConverting HSV to RGB ...")
-  RGB_map = HSV_to_RGB(map)
-  plt.imshow(np.clip(RGB_map, 0, 1))
-  plt.axis("off")
-  plt.savefig(output, bbox_inches="tight")  # Save image to file
+  if os.path.splitext(output)[1].lower() in export.WRITERS:
+    export.save_map(map, output)
+  else:
+    import matplotlib.pyplot as plt  # Only imported when needed, it is slow to import
+    RGB_map = HSV_to_RGB(map, np.uint8)
+    plt.imshow(RGB_map)
+    plt.axis("off")
+    plt.savefig(output, bbox_inches="tight")  # Save image to file
   print("\nMap saved to", output)
 
 # Start of script
 if __name__ == "__main__":
   print("=== PROCEDURAL CONTENT GENERATION ===")
   try:
-    print("Both resolutions are constrained by the perlin noise (see README)\n")
     res_X = int(input("Width of to be generated map >> "))
     res_Y = int(input("Height of to be generated map >> "))
     output = input("Output-file where generated map is saved >> ")
@@ -29,7 +35,12 @@ if __name__ == "__main__":
     print("Error: Invalid input.")
     exit(1)
 
+  logging.basicConfig(level=logging.INFO, format="%(message)s")  # Show the progress of the generation
   print("\n==== Start Generation ====")
   M = Map(res_X, res_Y)
   M.generate()                   # Generate the map with the procedures
-  save_map(M.get_map(), output)  # Save the map with pyplot
+  if output.lower().endswith(mapfile.EXTENSION):
+    mapfile.save(M, output)        # Native format, with the relief and the objects (see mapfile.py)
+    print("\nMap saved to", output)
+  else:
+    save_map(M.get_map(), output)  # Save the map with pyplot
@@ -0,0 +1,216 @@
+# Contains the native file format of maps: a compact file from which the HSV-map is rebuilt when it is loaded
+# A file holds the quantized relief, the biome of every pixel and the objects of the map (villages, roads, vegetation,
+# houses, boats and flags); the pixels which are not described by these (e.g. the volcano) are stored as they are
+# Layout: MAGIC, the length of the header (uint32), the header (JSON) and the sections, each aligned to ALIGNMENT
+# bytes. The relief is stored uncompressed, such that it can be memory-mapped (see relief_plane); the other sections
+# are compressed with zlib
+
+import json
+import zlib
+import struct
+import typing
+import numpy as np
+
+from settings import *
+from color import *
+from utility import channels, is_structured, HSV_DTYPE
+from PCG import Map, BIOME_COLORS, BIOME_THRESHOLDS, OBJECT_SPRITES
+from PCG import recolor_biomes, stamp_objects
+from sprites import FLAG_SPRITE
+
+EXTENSION = ".pcgmap"
+MAGIC = b"\x93PCGMAP"
+VERSION = 1
+ALIGNMENT = 64
+
+# The relief is stored as uint16 floor(relief * RELIEF_SCALE), so relief // RELIEF_SCALE is the exact Value of a pixel
+RELIEF_SCALE = 655
+
+# Biome of the pixels of the volcano, the other biomes are the indices in BIOME_COLORS (all fit in 3 bits)
+VOLCANO_BIOME = 7
+
+# The map is rebuilt in bands of BAND_ROWS rows, such that saving needs no second map in memory (see save)
+BAND_ROWS = 512
+
+# Objects of a map in the order in which they are stamped, see Map.__populate
+SPRITES = OBJECT_SPRITES + [("flags", FLAG_SPRITE)]
+
+
+#======== ROADS ========
+# A route is a path of pixels in which every pixel is one of the eight neighbours of the previous pixel
+# Only the first and last pixel, and the pixels where the direction changes are stored (as polyline)
+
+# Return the vertices of the polyline of the route
+def polyline(route: np.ndarray) -> np.ndarray:
+  route = np.asarray(route)
+  if len(route) <= 2:
+    return route
+  steps = np.diff(route, axis=0)
+  turns = np.any(steps[1:] != steps[:-1], axis=1)
+  return route[np.concatenate(([True], turns, [True]))]
+
+# Return the route of the vertices of a polyline
+def rasterize(vertices: np.ndarray) -> np.ndarray:
+  pixels = [vertices[:1]]
+  for start, end in zip(vertices[:-1], vertices[1:]):
+    n = np.abs(end - start).max()
+    pixels.append(start + np.sign(end - start) * np.arange(1, n+1)[:, None])
+  return np.concatenate(pixels)
+
+
+#======== REBUILDING ========
+# Return the biome of every pixel of the map (index in BIOME_COLORS, or VOLCANO_BIOME)
+def biome_plane(M: Map, value: np.ndarray) -> np.ndarray:
+  biomes = np.searchsorted(BIOME_THRESHOLDS, value, side="left").astype(np.uint8)  # As paint_biomes
+  biomes[(biomes == N_BIOMES-1) & ~M.snow] = VOLCANO_BIOME  # The volcano replaced the snow
+  return biomes
+
+# Rebuild the rows of the HSV-map from the quantized relief, the biomes, the objects and the routes of the map (see
+# Map.generate); window holds the channels (H, S, V) of the rows
+# The objects and routes are None if they are not known, then the pixels remain those of the biomes
+def rebuild(window: tuple, rows: slice, relief: np.ndarray, biomes: np.ndarray, objects: typing.Optional[dict],
+            routes: typing.Optional[typing.List[np.ndarray]], settings: dict) -> None:
+  hue, saturation, value = window
+  band = biomes[rows]
+  colors = np.concatenate((BIOME_COLORS, np.zeros((1, 2), dtype=BIOME_COLORS.dtype)))  # The volcano is stored as is
+  hue[...], saturation[...], value[...] = colors[band, 0], colors[band, 1], relief[rows] // RELIEF_SCALE
+  if objects is not None:
+    for name, sprite in SPRITES:
+      stamp_objects(window, (0, rows.start), relief.shape, [objects], [(name, sprite)])
+  if routes:
+    pixels = np.concatenate(routes)
+    pixels = pixels[(rows.start <= pixels[:, 1]) & (pixels[:, 1] < rows.stop)]
+    x, y = pixels[:, 0], pixels[:, 1]
+    water = relief[y, x] // RELIEF_SCALE < WATER_THRESHOLD
+    for channel, road, bridge in zip(window, ROAD, BRIDGE):
+      channel[y - rows.start, x] = np.where(water, bridge, road)
+  recolor_biomes(hue, value, settings)
+
+# Return the bands of BAND_ROWS rows of a map with res_Y rows, as slices
+def bands(res_Y: int) -> typing.List[slice]:
+  return [slice(start, min(start + BAND_ROWS, res_Y)) for start in range(0, res_Y, BAND_ROWS)]
+
+
+#======== FILES ========
+# Write the header and the sections (name -> (array, whether it is compressed)), the header gets their offsets
+def _write(file: typing.BinaryIO, header: dict, sections: typing.Dict[str, typing.Tuple[np.ndarray, bool]]) -> None:
+  # The offsets depend on the length of the header, which depends on the offsets: reserve room for the offsets
+  data = {name: array.tobytes() if not compress else zlib.compress(array.tobytes())
+          for name, (array, compress) in sections.items()}
+  header["sections"] = {name: {"offset": 0, "size": len(data[name]), "dtype": array.dtype.str,
+                               "shape": list(array.shape), "zlib": compress}
+                        for name, (array, compress) in sections.items()}
+  reserved = len(json.dumps(header)) + 20 * len(sections)
+  offset = -(-(len(MAGIC) + 4 + reserved) // ALIGNMENT) * ALIGNMENT
+  for name in sections:
+    header["sections"][name]["offset"] = offset
+    offset += -(-len(data[name]) // ALIGNMENT) * ALIGNMENT
+  text = json.dumps(header).encode().ljust(reserved)
+
+  file.write(MAGIC)
+  file.write(struct.pack("<I", len(text)))
+  file.write(text)
+  for name in sections:
+    file.write(b"\0" * (header["sections"][name]["offset"] - file.tell()))
+    file.write(data[name])
+
+# Return the header of the file
+def read_header(path: str) -> dict:
+  with open(path, "rb") as file:
+    if file.read(len(MAGIC)) != MAGIC:
+      raise ValueError("%s is not a map file" % path)
+    length, = struct.unpack("<I", file.read(4))
+    header = json.loads(file.read(length))
+  if header["version"] != VERSION:
+    raise ValueError("%s has version %d, expected %d" % (path, header["version"], VERSION))
+  return header
+
+# Return the section of the file, as array
+def _read(path: str, header: dict, name: str) -> np.ndarray:
+  section = header["sections"][name]
+  with open(path, "rb") as file:
+    file.seek(section["offset"])
+    data = file.read(section["size"])
+  if section["zlib"]:
+    data = zlib.decompress(data)
+  return np.frombuffer(data, dtype=section["dtype"]).reshape(section["shape"])
+
+# Return the quantized relief of the file as read-only memory-mapped uint16 array, the height is relief / RELIEF_SCALE
+def relief_plane(path: str) -> np.memmap:
+  section = read_header(path)["sections"]["relief"]
+  return np.memmap(path, dtype=section["dtype"], mode="r", offset=section["offset"], shape=tuple(section["shape"]))
+
+# Save the generated map in the file
+def save(M: Map, path: str) -> None:
+  relief = np.empty((M.res_Y, M.res_X), dtype=np.uint16)
+  for rows in bands(M.res_Y):
+    relief[rows] = np.floor(np.asarray(M.relief[rows], dtype=np.float64) * RELIEF_SCALE)
+  biomes = biome_plane(M, relief // RELIEF_SCALE)
+  sections = {"relief": (relief, False), "biomes": (biomes, True),
+              "villages": (np.array(M.origin_villages, dtype=np.int32).reshape(-1, 2), True)}
+  if M.objects is not None:
+    for name, _ in SPRITES:
+      x, y, colors = M.objects[name]
+      sections[name] = (np.stack((x, y), axis=1).astype(np.int32), True)
+      if colors is not None:
+        sections[name + "_colors"] = (np.asarray(colors, dtype=np.int16).reshape(-1, 3), True)
+  if M.routes is not None:
+    lines = [polyline(route) for route in M.routes]
+    sections["roads"] = (np.concatenate(lines).astype(np.int32) if lines else np.zeros((0, 2), np.int32), True)
+    sections["road_vertices"] = (np.array([len(line) for line in lines], dtype=np.int32), True)
+
+  # The pixels which differ from the rebuilt map, e.g. the volcano
+  differ, pixels = [], []
+  for rows in bands(M.res_Y):
+    band = np.empty((rows.stop - rows.start,) + M.map.shape[1:], dtype=M.map.dtype)
+    rebuild(channels(band), rows, relief, biomes, M.objects, M.routes, M.settings)
+    original = channels(M.map[rows])
+    y, x = np.nonzero(np.any(np.stack(channels(band)) != np.stack(original), axis=0))
+    differ.append((y + rows.start) * M.res_X + x)
+    pixels.append(np.stack([channel[y, x] for channel in original], axis=1).astype(np.int16))
+  sections["pixels"] = (np.concatenate(differ).astype(np.int64), True)
+  sections["pixel_colors"] = (np.concatenate(pixels), True)
+
+  header = {"version": VERSION, "resolution": [M.res_X, M.res_Y], "seed": M.seed, "entropy": M.entropy,
+            "compact": is_structured(M.map.dtype), "dtype": None if is_structured(M.map.dtype) else M.map.dtype.str,
+            "relief_dtype": M.relief.dtype.str, "settings": M.settings, "volcano": bool(M.volcano),
+            "counters": M.counters}
+  with open(path, "wb") as file:
+    _write(file, header, sections)
+
+# Load the map of the file, the HSV-map is rebuilt; directory is passed to Map (see Map)
+def load(path: str, directory: str = None) -> Map:
+  header = read_header(path)
+  res_X, res_Y = header["resolution"]
+  # The entropy of the seed is its own seed, so the random streams of the map are those of the saved map
+  seed = header["seed"] if header["seed"] is not None else header["entropy"]
+  M = Map(res_X, res_Y, seed, dtype=HSV_DTYPE if header["compact"] else np.dtype(header["dtype"]),
+          relief_dtype=np.dtype(header["relief_dtype"]), directory=directory)
+  M.seed = header["seed"]
+  M.settings.update(header["settings"])
+  M.settings["RES"] = tuple(M.settings["RES"])
+  M.volcano, M.counters = header["volcano"], header["counters"]
+  M.origin_villages = _read(path, header, "villages").tolist()
+
+  names = header["sections"]
+  if "flags" in names:
+    M.objects = {}
+    for name, _ in SPRITES:
+      points = _read(path, header, name)
+      colors = _read(path, header, name + "_colors") if name + "_colors" in names else None
+      M.objects[name] = (points[:, 0].astype(np.intp), points[:, 1].astype(np.intp), colors)
+  if "roads" in names:
+    ends = np.cumsum(_read(path, header, "road_vertices"))
+    vertices = _read(path, header, "roads").astype(np.intp)
+    M.routes = [rasterize(vertices[end-n:end]) for n, end in zip(np.diff(ends, prepend=0), ends)]
+
+  relief, biomes = relief_plane(path), _read(path, header, "biomes")
+  M.relief[...] = relief / RELIEF_SCALE
+  M.snow[...] = biomes == N_BIOMES-1
+  for rows in bands(res_Y):
+    rebuild(channels(M.map[rows]), rows, relief, biomes, M.objects, M.routes, M.settings)
+  differ, pixels = _read(path, header, "pixels"), _read(path, header, "pixel_colors")
+  y, x = np.unravel_index(differ, (res_Y, res_X))
+  for channel, component in zip(channels(M.map), pixels.T):
+    channel[y, x] = component
+  return M
@@ -1,5 +1,6 @@
 # Perlin implementation, taken from: https://github.com/pvigier/perlin-numpy/, by Pierre Vigier
 
+import functools
 import numpy as np
 
 
@@ -7,64 +8,186 @@ def interpolant(t):
   return t*t*t*(t*(t*6 - 15) + 10)
 
 
+@functools.lru_cache(maxsize=64)
+def lattice(shape, res, rows, cols, interpolant, dtype):
+  """Return the position of the rows and columns on the lattice.
+  The lattice only depends on the shape and res, not on the seed,
+  so it is computed once and shared by all noise of that shape.
+  Args:
+    shape: The shape of the array (tuple of two ints).
+    res: The number of periods along each axis (tuple of two ints).
+    rows: The rows of the array to generate (range).
+    cols: The columns of the array to generate (range).
+    interpolant: The interpolation function.
+    dtype: The floating point type of the positions.
+  Returns:
+    A tuple (x, y, cell_rows, cell_cols, t_x, t_y) of read-only 1D
+    arrays: the position of every row and column within its cell,
+    the cell of every row and column, and the interpolant of the
+    positions.
+  """
+  rows, cols = np.array(rows), np.array(cols)
+  delta = (res[0] / shape[0], res[1] / shape[1])
+  x = ((rows * delta[0]) % 1).astype(dtype)
+  y = ((cols * delta[1]) % 1).astype(dtype)
+  cell_rows, cell_cols = rows * res[0] // shape[0], cols * res[1] // shape[1]
+  arrays = (x, y, cell_rows, cell_cols, interpolant(x), interpolant(y))
+  for array in arrays:
+    array.flags.writeable = False
+  return arrays
+
+
 def generate_perlin_noise_2d(
-  shape, res, tileable=(False, False), interpolant=interpolant, seed=None):
+  shape, res, tileable=(False, False), interpolant=interpolant, seed=None,
+  window=None, dtype=np.float64):
   """Generate a 2D numpy array of perlin noise.
   Args:
     shape: The shape of the generated array (tuple of two ints).
-      This must be a multple of res.
+      Any shape is allowed, the lattice of res periods is stretched
+      over the array.
     res: The number of periods of noise to generate along each
-      axis (tuple of two ints). Note shape must be a multiple of
-      res.
+      axis (tuple of two ints).
     tileable: If the noise should be tileable along each axis
       (tuple of two bools). Defaults to (False, False).
       interpolant: The interpolation function, defaults to
       t*t*t*(t*(t*6 - 15) + 10).
+    seed: The seed of the gradients (int, numpy.random.SeedSequence
+      or numpy.random.Generator). The global random state of numpy is
+      not used. Defaults to None, a random seed.
+    window: Only generate this part of the array (tuple of two
+      slices, rows and columns). The values are identical to the
+      same part of the full array with the same seed. Defaults to the
+      full array.
+    dtype: The floating point type of the computation and of the
+      result. Defaults to np.float64, np.float32 halves the memory.
   Returns:
-    A numpy array of shape shape with the generated noise.
-  Raises:
-    ValueError: If shape is not a multiple of res.
+    A numpy array of shape shape (or of the window) with the
+    generated noise.
   """
-  np.random.seed(seed)
+  rng = np.random.default_rng(seed)
 
-  delta = (res[0] / shape[0], res[1] / shape[1])
-  d = (shape[0] // res[0], shape[1] // res[1])
-  grid = np.mgrid[0:res[0]:delta[0], 0:res[1]:delta[1]]\
-         .transpose(1, 2, 0) % 1
-  # Gradients
-  angles = 2*np.pi*np.random.rand(res[0]+1, res[1]+1)
-  gradients = np.dstack((np.cos(angles), np.sin(angles)))
+  if window is None:
+    window = (slice(0, shape[0]), slice(0, shape[1]))
+  # Position of every row and column within its cell of the lattice, the
+  # grid of points is the outer product of both
+  x, y, cell_rows, cell_cols, t_x, t_y = lattice(
+    tuple(shape), tuple(res), range(shape[0])[window[0]],
+    range(shape[1])[window[1]], interpolant, np.dtype(dtype))
+  # Gradients at the points of the lattice
+  angles = 2*np.pi*rng.random((res[0]+1, res[1]+1))
   if tileable[0]:
-    gradients[-1,:] = gradients[0,:]
+    angles[-1,:] = angles[0,:]
   if tileable[1]:
-    gradients[:,-1] = gradients[:,0]
-  gradients = gradients.repeat(d[0], 0).repeat(d[1], 1)
-  g00 = gradients[    :-d[0],    :-d[1]]
-  g10 = gradients[d[0]:     ,    :-d[1]]
-  g01 = gradients[    :-d[0],d[1]:     ]
-  g11 = gradients[d[0]:     ,d[1]:     ]
-  # Ramps
-  n00 = np.sum(np.dstack((grid[:,:,0]  , grid[:,:,1]  )) * g00, 2)
-  n10 = np.sum(np.dstack((grid[:,:,0]-1, grid[:,:,1]  )) * g10, 2)
-  n01 = np.sum(np.dstack((grid[:,:,0]  , grid[:,:,1]-1)) * g01, 2)
-  n11 = np.sum(np.dstack((grid[:,:,0]-1, grid[:,:,1]-1)) * g11, 2)
-  # Interpolation
-  t = interpolant(grid)
-  n0 = n00*(1-t[:,:,0]) + t[:,:,0]*n10
-  n1 = n01*(1-t[:,:,0]) + t[:,:,0]*n11
-  return np.sqrt(2)*((1-t[:,:,1])*n0 + t[:,:,1]*n1)
+    angles[:,-1] = angles[:,0]
+  gradient_x, gradient_y = np.cos(angles).astype(dtype), np.sin(angles).astype(dtype)
+  return interpolate(x, y, cell_rows, cell_cols, t_x, t_y, gradient_x, gradient_y)
+
+
+def interpolate(x, y, cell_rows, cell_cols, t_x, t_y, gradient_x, gradient_y):
+  """Interpolate the gradients of the lattice at a grid of points.
+  Args:
+    x, y: The position of every row and column within its cell.
+    cell_rows, cell_cols: The cell of every row and column, as index
+      into the gradients.
+    t_x, t_y: The interpolant of x and y.
+    gradient_x, gradient_y: The gradients at the points of the lattice
+      (2D arrays of the dtype of the result).
+  Returns:
+    A numpy array of shape (len(x), len(y)) with the noise.
+  """
+  # Ramp of the gradient at corner (i, j) of the cell of every point
+  def ramp(i, j):
+    corner = np.ix_(cell_rows+i, cell_cols+j)
+    n = (x-i)[:, None] * gradient_x[corner]
+    n += (y-j)[None, :] * gradient_y[corner]
+    return n
+  # Interpolation, in place to keep the number of temporary arrays low
+  t = t_x[:, None]
+  n0 = ramp(0, 0)
+  n0 *= 1-t
+  n0 += t*ramp(1, 0)
+  n1 = ramp(0, 1)
+  n1 *= 1-t
+  n1 += t*ramp(1, 1)
+  t = t_y[None, :]
+  n0 *= 1-t
+  n0 += t*n1
+  n0 *= np.sqrt(2)
+  return n0
+
+
+def _mix(h):
+  """Mix the bits of an array of uint64 (the finalizer of splitmix64)."""
+  h = h ^ (h >> np.uint64(30))
+  h = h * np.uint64(0xbf58476d1ce4e5b9)
+  h = h ^ (h >> np.uint64(27))
+  h = h * np.uint64(0x94d049bb133111eb)
+  return h ^ (h >> np.uint64(31))
+
+
+def lattice_angles(seed, rows, cols):
+  """Return the angles of the gradients at points of an infinite lattice.
+  The angle of every point is a hash of the seed and its position, so
+  any part of the lattice can be generated independently.
+  Args:
+    seed: The seed of the lattice (numpy.random.SeedSequence).
+    rows: The rows of the points (1D array of ints, may be negative).
+    cols: The columns of the points (1D array of ints, may be negative).
+  Returns:
+    A numpy array of shape (len(rows), len(cols)) with the angles.
+  """
+  key = seed.generate_state(1, np.uint64)[0]
+  with np.errstate(over="ignore"):
+    h = _mix(key ^ np.asarray(rows, dtype=np.int64).astype(np.uint64))
+    h = _mix(h[:, None] ^ np.asarray(cols, dtype=np.int64).astype(np.uint64)[None, :])
+  return (h >> np.uint64(11)) * (2*np.pi / 2**53)
+
+
+def generate_perlin_noise_region(
+  origin, shape, period, interpolant=interpolant, seed=None,
+  dtype=np.float64):
+  """Generate a region of 2D perlin noise on an infinite lattice.
+  Args:
+    origin: The position of the first row and column of the region
+      (tuple of two ints, may be negative).
+    shape: The shape of the region (tuple of two ints).
+    period: The size of a cell of the lattice, in pixels along each
+      axis (tuple of two numbers).
+    interpolant: The interpolation function, defaults to
+      t*t*t*(t*(t*6 - 15) + 10).
+    seed: The seed of the lattice (int or numpy.random.SeedSequence).
+      Defaults to None, a random seed.
+    dtype: The floating point type of the result. Defaults to
+      np.float64.
+  Returns:
+    A numpy array of shape shape with the noise of the region. The
+    noise of overlapping regions with the same seed is identical.
+  """
+  if not isinstance(seed, np.random.SeedSequence):
+    seed = np.random.SeedSequence(seed)
+  rows = (origin[0] + np.arange(shape[0])) / period[0]
+  cols = (origin[1] + np.arange(shape[1])) / period[1]
+  cell_rows, cell_cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+  x, y = (rows - cell_rows).astype(dtype), (cols - cell_cols).astype(dtype)
+  # Gradients at the points of the lattice around the region
+  angles = lattice_angles(
+    seed, np.arange(cell_rows[0], cell_rows[-1]+2),
+    np.arange(cell_cols[0], cell_cols[-1]+2))
+  gradient_x, gradient_y = np.cos(angles).astype(dtype), np.sin(angles).astype(dtype)
+  return interpolate(
+    x, y, cell_rows - cell_rows[0], cell_cols - cell_cols[0],
+    interpolant(x), interpolant(y), gradient_x, gradient_y)
 
 def generate_fractal_noise_2d(
   shape, res, octaves=1, persistence=0.5,
   lacunarity=2, tileable=(False, False),
-  interpolant=interpolant, seed=None):
+  interpolant=interpolant, seed=None, window=None, dtype=np.float64):
   """Generate a 2D numpy array of fractal noise.
   Args:
     shape: The shape of the generated array (tuple of two ints).
-      This must be a multiple of lacunarity**(octaves-1)*res.
+      Any shape is allowed.
     res: The number of periods of noise to generate along each
-      axis (tuple of two ints). Note shape must be a multiple of
-      (lacunarity**(octaves-1)*res).
+      axis (tuple of two ints).
     octaves: The number of octaves in the noise. Defaults to 1.
     persistence: The scaling factor between two octaves.
     lacunarity: The frequency factor between two octaves.
@@ -72,19 +195,75 @@ def generate_fractal_noise_2d(
       (tuple of two bools). Defaults to (False, False).
     interpolant: The, interpolation function, defaults to
             t*t*t*(t*(t*6 - 15) + 10).
+    seed: The seed of the noise (int or numpy.random.SeedSequence).
+      Every octave gets its own gradients, seeded by a child of this
+      seed. Defaults to None, a random seed.
+    window: Only generate this part of the array (tuple of two
+      slices, rows and columns). The values are identical to the
+      same part of the full array with the same seed (not None).
+      Defaults to the full array.
+    dtype: The floating point type of the computation and of the
+      result. Defaults to np.float64.
+  Returns:
+    A numpy array of fractal noise and of shape shape (or of the
+    window) generated by combining several octaves of perlin noise.
+  """
+  if not isinstance(seed, np.random.SeedSequence):
+    seed = np.random.SeedSequence(seed)
+  if window is None:
+    window = (slice(0, shape[0]), slice(0, shape[1]))
+  noise = np.zeros((len(range(shape[0])[window[0]]), len(range(shape[1])[window[1]])), dtype=dtype)
+  frequency = 1
+  amplitude = 1
+  for i in range(octaves):
+    # The children are derived from the seed directly (not with spawn),
+    # such that every call with the same seed gives the same noise
+    octave_seed = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,))
+    octave = generate_perlin_noise_2d(
+      shape, (frequency*res[0], frequency*res[1]), tileable, interpolant,
+      octave_seed, window, dtype)
+    octave *= amplitude
+    noise += octave
+    frequency *= lacunarity
+    amplitude *= persistence
+  return noise
+
+def generate_fractal_noise_region(
+  origin, shape, period, octaves=1, persistence=0.5, lacunarity=2,
+  interpolant=interpolant, seed=None, dtype=np.float64):
+  """Generate a region of 2D fractal noise on an infinite lattice.
+  Args:
+    origin: The position of the first row and column of the region
+      (tuple of two ints, may be negative).
+    shape: The shape of the region (tuple of two ints).
+    period: The size of a cell of the lattice of the first octave, in
+      pixels along each axis (tuple of two numbers).
+    octaves: The number of octaves in the noise. Defaults to 1.
+    persistence: The scaling factor between two octaves.
+    lacunarity: The frequency factor between two octaves.
+    interpolant: The interpolation function, defaults to
+      t*t*t*(t*(t*6 - 15) + 10).
+    seed: The seed of the noise (int or numpy.random.SeedSequence).
+      Every octave gets its own lattice, seeded by a child of this
+      seed. Defaults to None, a random seed.
+    dtype: The floating point type of the result. Defaults to
+      np.float64.
   Returns:
-    A numpy array of fractal noise and of shape shape generated by
-    combining several octaves of perlin noise.
-  Raises:
-    ValueError: If shape is not a multiple of
-    (lacunarity**(octaves-1)*res).
+    A numpy array of shape shape with the fractal noise of the region.
+    The noise of overlapping regions with the same seed is identical.
   """
-  noise = np.zeros(shape)
+  if not isinstance(seed, np.random.SeedSequence):
+    seed = np.random.SeedSequence(seed)
+  noise = np.zeros(shape, dtype=dtype)
   frequency = 1
   amplitude = 1
-  for _ in range(octaves):
-    noise += amplitude * generate_perlin_noise_2d(
-      shape, (frequency*res[0], frequency*res[1]), tileable, interpolant, seed)
+  for i in range(octaves):
+    octave_seed = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,))
+    octave = generate_perlin_noise_region(
+      origin, shape, (period[0]/frequency, period[1]/frequency),
+      interpolant, octave_seed, dtype)
+    octave *= amplitude
+    noise += octave
     frequency *= lacunarity
     amplitude *= persistence
-  return noise
\ No newline at end of file
+  return noise
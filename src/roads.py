@@ -0,0 +1,165 @@
+# Contains the planning of the roads between villages and the routing of the roads
+
+import typing
+import math
+import heapq
+import numpy as np
+
+from settings import *
+
+#======== SPATIAL INDEX ========
+# Offsets of the neighbouring cells which are compared with a cell, such that every pair of cells is compared once
+FORWARD_CELLS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+# Spatial index of points (e.g. the origins of villages), the points are bucketed in a grid of square cells
+# The cells are larger than max_dist, so points within max_dist of each other are in the same or neighbouring cells
+class GridIndex:
+  def __init__(self, points: typing.List[list], max_dist: int) -> None:
+    self.points = np.asarray(points, dtype=np.intp).reshape(-1, 2)
+    self.max_dist = max_dist
+    self.cell = max_dist + 1
+
+    self.buckets = {}  # Cell (x,y) -> indices of the points in that cell
+    for index, key in enumerate(map(tuple, (self.points // self.cell).tolist())):
+      self.buckets.setdefault(key, []).append(index)
+    self.buckets = {key: np.array(indices) for key, indices in self.buckets.items()}
+
+    self.examined = 0  # Number of pairs of which the distance is computed
+
+  # Return all pairs (i,j) with i < j of points within max_dist of each other, sorted on (i,j)
+  # The distance is the truncated Euclidian distance, as utility.euclidian_dist
+  def pairs(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+    first, second = [], []
+    for (cx, cy), bucket in self.buckets.items():
+      for dx, dy in FORWARD_CELLS:
+        other = self.buckets.get((cx+dx, cy+dy))
+        if other is None:
+          continue
+        # Squared distances between all points of both cells
+        delta = self.points[bucket][:, None] - self.points[other][None, :]
+        near = (delta**2).sum(axis=2) < (self.max_dist+1)**2  # int(sqrt(d)) <= max_dist
+        if (dx, dy) == (0, 0):  # Within the same cell, every pair once
+          near &= bucket[:, None] < other[None, :]
+        self.examined += near.size if (dx, dy) != (0, 0) else len(bucket)*(len(bucket)-1) // 2
+        i, j = np.nonzero(near)
+        first.append(bucket[i])
+        second.append(other[j])
+
+    if not first:
+      return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    first, second = np.concatenate(first), np.concatenate(second)
+    i, j = np.minimum(first, second), np.maximum(first, second)
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+#======== ROUTING ========
+# Cost of a road through pixels with the given heights: roads have to avoid the mountains and need a bridge over water
+def road_costs(height: np.ndarray, road: float = ROAD_COST, bridge: float = BRIDGE_COST) -> np.ndarray:
+  height = np.floor(height)
+  cost = np.full(height.shape, road, dtype=np.float32)
+  cost[height < WATER_THRESHOLD] = bridge
+  cost[height > DIRT_THRESHOLD] = np.inf
+  return cost
+
+# Grid of the costs of a relief, the costs are only computed for the parts which are requested
+class CostGrid:
+  def __init__(self, relief: np.ndarray, road: float = ROAD_COST, bridge: float = BRIDGE_COST) -> None:
+    self.relief = relief
+    self.shape = relief.shape
+    self.road = road
+    self.bridge = bridge
+
+  def __getitem__(self, window: typing.Tuple[slice, slice]) -> np.ndarray:
+    return road_costs(self.relief[window], self.road, self.bridge)
+
+# Steps to the eight neighbouring pixels, as (dx, dy, length)
+STEPS = [(dx, dy, math.hypot(dx, dy)) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dx, dy) != (0, 0)]
+
+# Router which finds the cheapest road between two pixels with A*, over a grid with the cost of every pixel
+# The grid is an array or a CostGrid, only the windows around the searched routes are read
+# A step costs the mean cost of both pixels times its length
+# Impassable pixels have an infinite cost; the search is bounded by a window around both ends and a budget
+# Pixels of the earlier routes cost reuse times their cost, such that later roads share the existing roads where possible
+# The heuristic ignores this discount, so a route costs at most 1/reuse times the cheapest route, but far fewer pixels
+# are expanded than with the admissible heuristic
+class Router:
+  def __init__(self, cost: np.ndarray, budget: int, margin: int, reuse: float = 1.0) -> None:
+    self.cost = cost
+    self.budget = budget  # Max number of expanded pixels per route
+    self.margin = margin  # Margin of the window around both ends
+    self.reuse = reuse    # Factor of the cost of a pixel with a road
+    self.roads = set()    # Pixels (y*width + x) of the routes found so far
+
+    self.expanded = 0  # Total number of expanded pixels
+    self.shared = 0    # Number of pixels of routes which were already road
+
+  # Return the cheapest route from start to end (as array of (x,y)), or None if there is no route within the bounds
+  def route(self, start: list, end: list) -> typing.Optional[np.ndarray]:
+    route = self.__search(tuple(start), tuple(end))
+    if route is not None:
+      pixels = (route[:, 1] * self.cost.shape[1] + route[:, 0]).tolist()
+      self.shared += sum(pixel in self.roads for pixel in pixels)
+      self.roads.update(pixels)
+    return route
+
+  # A* from start to end within the window around both
+  def __search(self, start: tuple, end: tuple) -> typing.Optional[np.ndarray]:
+    res_Y, res_X = self.cost.shape
+    x0, y0 = max(min(start[0], end[0]) - self.margin, 0), max(min(start[1], end[1]) - self.margin, 0)
+    x1 = min(max(start[0], end[0]) + self.margin + 1, res_X)
+    y1 = min(max(start[1], end[1]) + self.margin + 1, res_Y)
+    width, height = x1 - x0, y1 - y0
+    cost = np.array(self.cost[y0:y1, x0:x1], dtype=np.float64)
+    y, x = np.divmod(np.fromiter(self.roads, dtype=np.int64, count=len(self.roads)), res_X)
+    inside = (x >= x0) & (x < x1) & (y >= y0) & (y < y1)
+    min_cost = float(cost.min())  # Cheapest pixel of the window without roads, see Router
+    cost[y[inside]-y0, x[inside]-x0] *= self.reuse  # Every pixel occurs once in roads
+    cost = cost.ravel().tolist()  # Python floats are faster to index in the loop below
+
+    source = (start[1]-y0)*width + start[0]-x0
+    target_x, target_y = end[0]-x0, end[1]-y0
+    target = target_y*width + target_x
+    diagonal = math.sqrt(2) - 2
+
+    # Octile distance to the end, scaled with the cheapest cost
+    def heuristic(x: int, y: int) -> float:
+      dx, dy = abs(x - target_x), abs(y - target_y)
+      return min_cost * (dx + dy + diagonal*min(dx, dy))
+
+    best = {source: 0.0}
+    parent = {source: -1}
+    closed = set()
+    heap = [(heuristic(start[0]-x0, start[1]-y0), 0.0, source)]
+    expanded = 0
+    while heap and expanded < self.budget:
+      _, g, pixel = heapq.heappop(heap)
+      g = -g
+      if pixel == target:
+        break
+      if pixel in closed:
+        continue
+      closed.add(pixel)
+      expanded += 1
+      x, y, here = pixel % width, pixel // width, cost[pixel]
+      for dx, dy, length in STEPS:
+        nx, ny = x + dx, y + dy
+        if 0 <= nx < width and 0 <= ny < height:
+          neighbour = pixel + dy*width + dx
+          step = cost[neighbour]
+          if step == math.inf:  # Impassable
+            continue
+          g_new = g + (here + step)/2 * length  # Same cost in both directions, so a route can be reversed
+          if g_new < best.get(neighbour, math.inf):
+            best[neighbour] = g_new
+            parent[neighbour] = pixel
+            heapq.heappush(heap, (g_new + heuristic(nx, ny), -g_new, neighbour))  # Ties: prefer the furthest
+    self.expanded += expanded
+    if target not in parent:  # No route within the bounds
+      return None
+
+    route = [target]
+    while parent[route[-1]] != -1:
+      route.append(parent[route[-1]])
+    route = np.array(route[::-1])
+    return np.stack((route % width + x0, route // width + y0), axis=1)
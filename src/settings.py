@@ -36,6 +36,10 @@ P_BOAT = 0.00005           # Prob. of generating a boat
 #======== PERLIN/FRACTAL NOISE ========
 OCTAVE = 5
 RES = (3,4)
+# The relief of world.World has no borders: a period of its first octave has a fixed size (in pixels, rows x columns),
+# that of RES at 720p, and the noise is normalized with the extremes [-WORLD_NOISE, WORLD_NOISE] (those of a map of 720p)
+WORLD_PERIOD = (240, 320)
+WORLD_NOISE = 1.03
 
 
 #======== MISC. ========
@@ -45,6 +49,13 @@ SIZE_HOUSE = 2
 
 MAX_DIST = 128  # Max distance between two villages to create road between them
                 # (Euclidian distance)
+ROAD_COST = 1       # Cost of a road through one pixel of land
+BRIDGE_COST = 4     # Cost of a bridge through one pixel of water, roads avoid water if possible
+ROAD_BUDGET = 20000 # Max number of pixels which are visited to find the route of one road
+ROAD_MARGIN = 32    # Margin (in pixels) around both villages in which the route of a road is searched
+ROAD_REUSE = 0.5    # Factor of the cost of a pixel which already has a road, later roads follow the earlier ones
 
 LEN_BOAT = 10   # Length of underside of boat (in pixels)
-LEN_SIDES = 5   # Length of diagonal part of boat (in pixels)
\ No newline at end of file
+LEN_SIDES = 5   # Length of diagonal part of boat (in pixels)
+
+MAX_SIZE_VOLCANO = 1000000  # Max size (in pixels) of the snow-region which can become the volcano
\ No newline at end of file
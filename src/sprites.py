@@ -0,0 +1,106 @@
+# Contains the sprites of the objects which populate the map, and the procedure to stamp them on the map
+# A sprite is defined once with masks and colors; stamping draws many instances of it in one call
+
+import typing
+import numpy as np
+
+from settings import *
+from color import *
+
+# Definition of a sprite, drawn relative to the origin (x,y) of an object
+class Sprite:
+  # layers: list of (mask, color), all masks have the same shape and later layers are drawn on top
+  #         if color is None, the color of that layer is given per instance (see stamp)
+  # offset: position of the top-left pixel of the sprite relative to the origin, as (x,y)
+  # avoid:  Hue of the pixels which may not be overwritten (e.g. houses are not built on water)
+  # clip:   instances partially outside of the map are clipped, otherwise they are not drawn at all
+  def __init__(self, layers: typing.List[typing.Tuple[np.ndarray, list]], offset: typing.Tuple[int, int],
+               avoid: int = None, clip: bool = True) -> None:
+    self.height, self.width = layers[0][0].shape
+    self.offset = offset
+    self.avoid = avoid
+    self.clip = clip
+
+    colors = np.zeros((self.height, self.width, 3), dtype=int)
+    variable = np.zeros((self.height, self.width), dtype=bool)
+    mask = np.zeros((self.height, self.width), dtype=bool)
+    for layer, color in layers:
+      mask |= layer
+      variable[layer] = color is None
+      if color is not None:
+        colors[layer] = color
+
+    # Drawn pixels of the sprite: their position relative to the origin, color and whether the color is variable
+    dy, dx = np.nonzero(mask)
+    self.dx, self.dy = dx + offset[0], dy + offset[1]
+    self.colors = colors[dy, dx]
+    self.variable = variable[dy, dx]
+    self.reach = int(max(np.abs(self.dx).max(), np.abs(self.dy).max()))  # Max distance of a pixel to the origin
+
+  # Draw the sprite with its origin at every (x[i], y[i]) on the map with the given channels (H, S, V)
+  # colors contains the color of the variable layers of every instance, one row per instance
+  # The channels can also be a window of a larger map: offset is the position of the window (x,y), shape the
+  # shape of the whole map; only the part of the instances in the window is drawn
+  def stamp(self, channels: typing.Tuple[np.ndarray, np.ndarray, np.ndarray],
+            x: np.ndarray, y: np.ndarray, colors: np.ndarray = None,
+            offset: typing.Tuple[int, int] = (0, 0), shape: typing.Tuple[int, int] = None) -> None:
+    x = np.asarray(x, dtype=np.intp).reshape(-1, 1)
+    y = np.asarray(y, dtype=np.intp).reshape(-1, 1)
+    res_Y, res_X = channels[0].shape if shape is None else shape
+    height, width = channels[0].shape
+
+    # Skip the instances which do not overlap the window
+    overlap = ((x + self.dx.max() >= offset[0]) & (x + self.dx.min() < offset[0] + width) &
+               (y + self.dy.max() >= offset[1]) & (y + self.dy.min() < offset[1] + height))[:, 0]
+    x, y = x[overlap], y[overlap]
+    if colors is not None:
+      colors = np.asarray(colors).reshape(-1, 3)[overlap]
+
+    # Position of every pixel of every instance, one row per instance
+    X, Y = x + self.dx, y + self.dy
+    inside = (0 <= X) & (X < res_X) & (0 <= Y) & (Y < res_Y)
+    if not self.clip:  # Only draw the instances which fit entirely on the map
+      inside &= inside.all(axis=1, keepdims=True)
+    X, Y = X - offset[0], Y - offset[1]
+    inside &= (0 <= X) & (X < width) & (0 <= Y) & (Y < height)
+
+    pixel_colors = np.repeat(self.colors[None], len(x), axis=0)
+    if colors is not None:
+      pixel_colors[:, self.variable] = colors[:, None]
+
+    X, Y, pixel_colors = X[inside], Y[inside], pixel_colors[inside]
+    if self.avoid is not None:
+      keep = channels[0][Y, X] != self.avoid
+      X, Y, pixel_colors = X[keep], Y[keep], pixel_colors[keep]
+
+    for channel, component in zip(channels, pixel_colors.T):
+      channel[Y, X] = component
+
+
+#======== DEFINITIONS OF THE SPRITES ========
+# Return a mask of the given shape with only the given rows and columns set
+def _mask(height: int, width: int, rows: slice = slice(None), cols: slice = slice(None)) -> np.ndarray:
+  mask = np.zeros((height, width), dtype=bool)
+  mask[rows, cols] = True
+  return mask
+
+# Bush (3x3) above and left of the origin, a tree also has a trunk
+BUSH_SPRITE = Sprite([(_mask(3, 3), PLANT)], (-3, -3))
+TREE_SPRITE = Sprite([(_mask(4, 3, slice(0, 3)), PLANT), (_mask(4, 3, 3, 1), TRUNK)], (-3, -3))
+
+# House (square of SIZE_HOUSE+1) above and left of the origin, it is not built on water
+HOUSE_SPRITE = Sprite([(_mask(SIZE_HOUSE+1, SIZE_HOUSE+1), HOUSE)], (-SIZE_HOUSE, -SIZE_HOUSE), avoid=WATER[0])
+
+# Boat: a trapezium as underside with a (random) colored top half, only drawn if it fits on the map
+def _boat() -> Sprite:
+  height, width = 2*LEN_SIDES + 1, LEN_BOAT + 2*LEN_SIDES
+  bottom = np.zeros((height, width), dtype=bool)
+  for j in range(-LEN_SIDES, 1):  # Every row of the underside is one pixel shorter on both sides
+    bottom[j + 2*LEN_SIDES, -LEN_BOAT+j + LEN_BOAT+LEN_SIDES : -j + LEN_BOAT+LEN_SIDES] = True
+  top = _mask(height, width, slice(0, LEN_SIDES), slice(LEN_BOAT-3, LEN_BOAT+LEN_SIDES+1))
+  return Sprite([(bottom, BOAT_BROWN), (top, None)], (-LEN_BOAT-LEN_SIDES, -2*LEN_SIDES), clip=False)
+BOAT_SPRITE = _boat()
+
+# Flag: a black pole with a red flag, only drawn if it fits on the map
+FLAG_SPRITE = Sprite([(_mask(8, 4, slice(None), 0), FLAG_BLACK), (_mask(8, 4, slice(1, 3), slice(1, 4)), FLAG_RED)],
+                     (0, -3), clip=False)
@@ -2,6 +2,7 @@
 
 import typing
 import math
+import functools
 import numpy as np
 
 #======== DISTANCE BETWEEN TWO VECTORS ========
@@ -11,40 +12,128 @@ def euclidian_dist(V1: list, V2: list) -> int:
     sum += (V2[i] - V1[i])**2
   return int(math.sqrt(sum))
 
+#======== CONNECTED REGIONS ========
+# Connected regions (8-connectivity) of a boolean mask, e.g. the snow of a map
+# The regions are stored as horizontal runs of pixels, so the memory is bounded by the number of runs
+class Regions:
+  def __init__(self, mask: np.ndarray, chunk: int = 256) -> None:
+    self.shape = mask.shape
+    # Runs of pixels per row: row, start and end (exclusive), in order of the rows; found per chunk of rows
+    rows, starts, ends = [], [], []
+    for y in range(0, mask.shape[0], chunk):
+      edges = np.diff(mask[y:y+chunk].astype(np.int8), axis=1, prepend=0, append=0)
+      row, start = np.nonzero(edges == 1)
+      ends.append(np.nonzero(edges == -1)[1])
+      rows.append(row + y)
+      starts.append(start)
+    self.rows, self.starts, self.ends = (np.concatenate(a) if a else np.zeros(0, dtype=np.intp) for a in (rows, starts, ends))
+
+    # Runs in consecutive rows are connected if they overlap (or touch diagonally)
+    width = mask.shape[1] + 2
+    start_keys, end_keys = self.rows*width + self.starts, self.rows*width + self.ends
+    first = np.searchsorted(end_keys, (self.rows+1)*width + self.starts, side="left")
+    last = np.searchsorted(start_keys, (self.rows+1)*width + self.ends, side="right")
+    count = np.maximum(last - first, 0)
+    a = np.repeat(np.arange(len(self.rows)), count)
+    b = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(first, count)
+
+    # Label the runs: merge the trees of connected runs until nothing changes
+    labels = np.arange(len(self.rows))
+    while True:
+      merged = labels.copy()
+      lowest = np.minimum(labels[a], labels[b])
+      np.minimum.at(merged, labels[a], lowest)
+      np.minimum.at(merged, labels[b], lowest)
+      while not np.array_equal(merged, merged[merged]):  # Point every run to the root of its tree
+        merged = merged[merged]
+      if np.array_equal(merged, labels):
+        break
+      labels = merged
+    _, self.labels = np.unique(labels, return_inverse=True)  # Label of every run, in [0, number of regions)
+    self.sizes = np.bincount(self.labels, weights=self.ends - self.starts).astype(np.intp)
+
+  # Return the number of regions
+  def __len__(self) -> int:
+    return len(self.sizes)
+
+  # Return the label of the region containing pixel (x,y), or -1 if the pixel is not in the mask
+  def label_at(self, x: int, y: int) -> int:
+    run = np.searchsorted(self.rows*(self.shape[1]+2) + self.starts, y*(self.shape[1]+2) + x, side="right") - 1
+    if run < 0 or self.rows[run] != y or not x < self.ends[run]:
+      return -1
+    return int(self.labels[run])
+
+  # Return the coordinates (x and y) of the pixels of the given runs, in order of the rows
+  def run_pixels(self, runs: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    lengths = self.ends[runs] - self.starts[runs]
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(self.starts[runs], lengths) + offsets, np.repeat(self.rows[runs], lengths)
+
+  # Return the coordinates (x and y) of all pixels of the region with the given label
+  def pixels(self, label: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    return self.run_pixels(np.flatnonzero(self.labels == label))
+
+#======== STORAGE OF HSV-MAPS ========
+# Compact layout of a HSV-pixel: Hue in [0,360] needs 16 bits, Saturation and Value in [0,100] need 8 bits
+HSV_DTYPE = np.dtype([("H", np.uint16), ("S", np.uint8), ("V", np.uint8)])
+
+# Is the dtype a structured dtype (one field per component), such as HSV_DTYPE?
+def is_structured(dtype: np.dtype) -> bool:
+  return np.dtype(dtype).names is not None
+
+# Return views on the H, S and V components of the map, which is either of shape (Y, X, 3) or structured
+def channels(map: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  if is_structured(map.dtype):
+    return tuple(map[name] for name in map.dtype.names)
+  return map[..., 0], map[..., 1], map[..., 2]
+
+#======== DOWNSAMPLING ========
+# Return the mean of every block of 2x2 values of the 2D array, of shape (ceil(Y/2), ceil(X/2))
+# An odd last row or column is averaged with itself
+def downsample(array: np.ndarray) -> np.ndarray:
+  array = np.asarray(array, dtype=np.float64 if array.dtype.kind != "f" else array.dtype)
+  array = np.pad(array, ((0, len(array) % 2), (0, array.shape[1] % 2)), mode="edge")
+  return (array[0::2, 0::2] + array[1::2, 0::2] + array[0::2, 1::2] + array[1::2, 1::2]) / 4
+
 #======== CONVERSION OF HSV TO RGB ========
-# Converts H, C and X to tuple of C, X and 0 in correct order on the basis of H
-def convert(H: float, C: float, X: float) -> typing.Tuple[float, float, float]:
-  if 0 <= H < 60:
-    return (C, X, 0)
-  elif 60 <= H < 120:
-    return (X, C, 0)
-  elif 120 <= H < 180:
-    return (0, C, X)
-  elif 180 <= H < 240:
-    return (0, X, C)
-  elif 240 <= H < 300:
-    return (X, 0, C)
-  elif 300 <= H <= 360:
-    return (C, 0, X)
+# Per sector of the Hue (60 degrees), the order in which (C, X, 0) are assigned to R, G and B
+SECTOR_ORDER = np.array([[0, 1, 2], [1, 0, 2], [2, 0, 1], [2, 1, 0], [1, 2, 0], [0, 2, 1]])
 
-# Converts the HSV values to RGB, for plot purposes
-def HSV_to_RGB(map: np.ndarray) -> np.ndarray:
-  res_X, res_Y = len(map[0]), len(map)
-  RGB_map = np.empty((res_Y, res_X, 3))
+# Converts arrays of H, S and V (H in [0,360], S and V in [0,100]) to RGB-values (in [0,1])
+def hsv_to_rgb_arrays(H: np.ndarray, S: np.ndarray, V: np.ndarray) -> np.ndarray:
+  H = np.asarray(H, dtype=np.float32)
+  S = np.asarray(S, dtype=np.float32) / 100  # Such that S and V will be in [0, 1]
+  V = np.asarray(V, dtype=np.float32) / 100
 
-  # Divide by vector for RGB-conversion, such that S and V will be in [0, 1]
-  div = np.array([1, 100, 100])
+  C = S * V
+  X = C * (1 - np.abs((H / 60) % 2 - 1))
+  m = V - C
 
-  for y in range(res_Y):
-    for x in range(res_X):
-      pixel = map[y][x] / div  # Divide by vector, and convert to floats
+  sector = np.clip(H // 60, 0, 5).astype(np.intp)  # H == 360 belongs to the last sector
+  RGB = np.take_along_axis(np.stack((C, X, np.zeros_like(C)), axis=-1), SECTOR_ORDER[sector], axis=-1)
+  RGB += m[..., None]
+  return RGB
 
-      # Convert HSV-pixel to RGB-values
-      C = pixel[1] * pixel[2]
-      X = C * (1 - abs((pixel[0] / 60) % 2 - 1))
-      m = pixel[2] - C
+# Convert floats in [0,1] to the requested dtype, integer types are scaled to [0,255]
+def _to_dtype(RGB: np.ndarray, dtype: np.dtype) -> np.ndarray:
+  if np.issubdtype(dtype, np.integer):
+    return np.rint(np.clip(RGB, 0, 1) * 255).astype(dtype)
+  return RGB.astype(dtype, copy=False)
 
-      # Compute final values of RGB-pixel
-      RGB_map[y][x] = convert(pixel[0], C, X) + m
+# Lookup-table with the RGB-value of every possible HSV-value, indexed with (H*101 + S)*101 + V
+@functools.lru_cache(maxsize=None)
+def HSV_LUT(dtype: np.dtype = np.dtype(np.uint8)) -> np.ndarray:
+  H, S, V = np.meshgrid(np.arange(361), np.arange(101), np.arange(101), indexing="ij")
+  return _to_dtype(hsv_to_rgb_arrays(H, S, V), dtype).reshape(-1, 3)
 
-  return RGB_map
\ No newline at end of file
+# Converts the HSV values to RGB, for plot purposes
+# If lut is True, the conversion is one lookup in HSV_LUT; the HSV-values are then clipped to their range
+def HSV_to_RGB(map: np.ndarray, dtype: np.dtype = np.float32, lut: bool = False) -> np.ndarray:
+  dtype = np.dtype(dtype)
+  H, S, V = channels(map)
+  if lut:
+    H = np.clip(H, 0, 360).astype(np.intp)
+    S = np.clip(S, 0, 100)
+    V = np.clip(V, 0, 100)
+    return HSV_LUT(dtype)[(H*101 + S)*101 + V]
+  return _to_dtype(hsv_to_rgb_arrays(H, S, V), dtype)
@@ -0,0 +1,145 @@
+# Contains the World: a map without borders, of which any region is generated on demand
+# The world consists of chunks of chunk_size x chunk_size pixels, every chunk only depends on the seed and its position
+# Like the tiles of Map (see Map.tiles), the objects are selected per chunk with their own random streams; objects
+# which cross the border of a chunk are drawn in both chunks. The volcano and the roads span a whole map, so a World
+# has neither
+
+import typing
+import functools
+import collections
+import numpy as np
+
+from perlin2d import generate_fractal_noise_region
+from settings import *
+from color import *
+from utility import channels, is_structured
+from PCG import STREAMS, MAX_REACH, OBJECT_SPRITES, default_settings
+from PCG import paint_biomes, recolor_biomes, select_objects, select_flags, stamp_objects
+from sprites import FLAG_SPRITE
+
+# Size (in pixels) of the chunks of a world, and the number of chunks which are kept in memory
+CHUNK_SIZE = 256
+CACHE_CHUNKS = 64
+
+
+class World:
+  # Initialization of the world, the seed is optional (see Map)
+  # cache_size is the number of generated chunks which are kept, the least recently used chunks are removed
+  # dtype and relief_dtype are the dtypes of the HSV-map and the height-map, see Map
+  def __init__(self, seed: int = None, chunk_size: int = CHUNK_SIZE, cache_size: int = CACHE_CHUNKS,
+               dtype: np.dtype = int, relief_dtype: np.dtype = np.float64) -> None:
+    if chunk_size < 2*MAX_REACH:  # Objects of the neighbouring chunks have to fit in the 3x3 chunks around a chunk
+      raise ValueError("chunk_size must be at least %d" % (2*MAX_REACH))
+    if cache_size < 1:
+      raise ValueError("cache_size must be at least 1")
+    self.seed = seed
+    self.chunk_size = chunk_size
+    self.cache_size = cache_size
+    self.dtype = dtype
+    self.relief_dtype = relief_dtype
+    self.settings = default_settings()
+
+    # The streams are derived from the seed as those of Map, with one stream per feature and chunk
+    self.entropy = np.random.SeedSequence(seed).entropy
+    self.relief_seed = np.random.SeedSequence(self.entropy, spawn_key=(STREAMS.index("relief"),))
+
+    # Chunk (x,y) -> terrain (map with biomes, relief and the selected objects), and chunk (x,y) -> final map
+    # Completing a chunk needs the terrain of its 8 neighbours, which are also kept for the next chunks
+    self.terrain = collections.OrderedDict()
+    self.chunks = collections.OrderedDict()
+    self.hits = 0    # Number of chunks which were requested and in the cache
+    self.misses = 0  # Number of chunks which were generated
+
+  # Return the HSV-map of the region of w x h pixels with its top-left pixel at (x0,y0), any position is allowed
+  def region(self, x0: int, y0: int, w: int, h: int) -> np.ndarray:
+    region = np.empty((h, w) if is_structured(self.dtype) else (h, w, 3), dtype=self.dtype)
+    return self.__assemble(region, x0, y0, self.__chunk)
+
+  # Return the height-map (values in range [0,100]) of the region, see region
+  def relief(self, x0: int, y0: int, w: int, h: int) -> np.ndarray:
+    return self.__assemble(np.empty((h, w), dtype=self.relief_dtype), x0, y0,
+                           lambda chunk: self.__terrain(chunk)["relief"])
+
+  # Private methods of class
+
+  # Copy the arrays (of get) of the chunks which overlap the region into the region, return the region
+  def __assemble(self, region: np.ndarray, x0: int, y0: int, get: typing.Callable[[tuple], np.ndarray]) -> np.ndarray:
+    size = self.chunk_size
+    h, w = region.shape[:2]
+    for chunk_y in range(y0 // size, -(-(y0+h) // size)):
+      for chunk_x in range(x0 // size, -(-(x0+w) // size)):
+        # Overlap of the chunk and the region, in coordinates of the world
+        left, right = max(x0, chunk_x*size), min(x0+w, (chunk_x+1)*size)
+        top, bottom = max(y0, chunk_y*size), min(y0+h, (chunk_y+1)*size)
+        region[top-y0:bottom-y0, left-x0:right-x0] = \
+          get((chunk_x, chunk_y))[top-chunk_y*size:bottom-chunk_y*size, left-chunk_x*size:right-chunk_x*size]
+    return region
+
+  # Return the item key of the cache, generated with make if it is not cached; the cache keeps cache_size items
+  def __cached(self, cache: collections.OrderedDict, key: tuple, make: typing.Callable[[tuple], typing.Any]) -> typing.Any:
+    if key in cache:
+      cache.move_to_end(key)  # Most recently used
+      return cache[key]
+    item = cache[key] = make(key)
+    while len(cache) > self.cache_size:
+      cache.popitem(last=False)
+    return item
+
+  # Final HSV-map of the chunk
+  def __chunk(self, chunk: tuple) -> np.ndarray:
+    if chunk in self.chunks:
+      self.hits += 1
+    else:
+      self.misses += 1
+    return self.__cached(self.chunks, chunk, self.__complete)
+
+  # Terrain of the chunk: the biomes, the relief and the selected objects and flags
+  def __terrain(self, chunk: tuple) -> dict:
+    return self.__cached(self.terrain, chunk, self.__generate_terrain)
+
+  # Random stream of feature for the objects of the chunk, see Map.__stream
+  # The spawn key has to be non-negative, so the position of the chunk is mapped to 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+  def __stream(self, feature: str, chunk: tuple) -> np.random.Generator:
+    key = tuple(2*i if i >= 0 else -2*i - 1 for i in chunk)
+    return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=(STREAMS.index(feature),) + key))
+
+  # Generate the relief and biomes of the chunk, and select its objects (see Map.__select_populate)
+  def __generate_terrain(self, chunk: tuple) -> dict:
+    size = self.chunk_size
+    origin = (chunk[0]*size, chunk[1]*size)
+    noise = generate_fractal_noise_region((origin[1], origin[0]), (size, size), WORLD_PERIOD, self.settings["OCTAVE"],
+                                          seed=self.relief_seed, dtype=self.relief_dtype)
+    # Normalize to [0, 1] with the fixed extremes, then multiply with 100 for Value (of HSV)
+    relief = np.clip((noise + WORLD_NOISE) / (2*WORLD_NOISE) * 100, 0, 100)
+
+    map = np.zeros((size, size) if is_structured(self.dtype) else (size, size, 3), dtype=self.dtype)
+    hue, saturation, value = channels(map)
+    value[...] = relief
+    snow = paint_biomes(hue, saturation, value)
+
+    stream = functools.lru_cache(maxsize=None)(lambda feature: self.__stream(feature, chunk))  # One per feature
+    return {"map": map, "relief": relief,
+            "objects": select_objects(hue, origin, stream, self.settings),
+            "flags": select_flags(hue, snow, origin, stream, self.settings)}
+
+  # Place the objects of the chunk and its neighbours on the terrain of the chunk, then recolor it
+  def __complete(self, chunk: tuple) -> np.ndarray:
+    size = self.chunk_size
+    terrain = self.__terrain(chunk)
+    map = terrain["map"].copy()
+    window = channels(map)
+    # The objects are stamped in the 3x3 chunks around the chunk (in order of the rows, as Map.__neighbours), in
+    # coordinates relative to that block, such that the objects can be clipped to it like to the border of a map
+    corner = ((chunk[0]-1)*size, (chunk[1]-1)*size)
+    neighbours = [self.__terrain((chunk[0]+i, chunk[1]+j)) for j in range(-1, 2) for i in range(-1, 2)]
+    for kind, sprites in (("objects", OBJECT_SPRITES), ("flags", [("flags", FLAG_SPRITE)])):
+      objects = []
+      for neighbour in neighbours:
+        shifted = {}
+        for name, _ in sprites:
+          x, y, colors = neighbour[kind][name]
+          shifted[name] = (x - corner[0], y - corner[1], colors)
+        objects.append(shifted)
+      stamp_objects(window, (size, size), (3*size, 3*size), objects, sprites)
+    recolor_biomes(window[0], window[2], self.settings)
+    return map
@@ -0,0 +1,40 @@
+# Tests of the on-disk cache of maps (src/cache.py), run with: python -m pytest tests
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import mapfile
+from PCG import Map
+from cache import MapCache
+
+
+# A map of a cache hit is saved to the same file as the map which was generated without the cache
+def test_save_cache_hit(tmp_path):
+  M = Map(256, 192, 42)
+  M.generate()
+  mapfile.save(M, str(tmp_path / "cold.pcgmap"))
+
+  cache = MapCache(str(tmp_path / "cache"))
+  cache.generate(256, 192, 42)
+  hit = cache.generate(256, 192, 42)
+  assert cache.hits["recolor"] == 1
+  assert np.array_equal(hit.map, M.map)
+  mapfile.save(hit, str(tmp_path / "hit.pcgmap"))
+  assert (tmp_path / "hit.pcgmap").read_bytes() == (tmp_path / "cold.pcgmap").read_bytes()
+
+# A map which is restarted from a cached stage keeps the objects of that stage
+def test_restart_keeps_objects(tmp_path):
+  cache = MapCache(str(tmp_path), compress=True)
+  cache.generate(256, 192, 7)
+  M = cache.generate(256, 192, 7, {"P_ROAD": 1.0})
+  assert cache.hits["populate"] == 1
+  R = Map(256, 192, 7)
+  R.settings["P_ROAD"] = 1.0
+  R.generate()
+  assert np.array_equal(M.map, R.map)
+  for name, (x, y, _) in R.objects.items():
+    assert np.array_equal(M.objects[name][0], x) and np.array_equal(M.objects[name][1], y)
+  assert len(M.routes) == len(R.routes)